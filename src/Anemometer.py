@@ -0,0 +1,159 @@
+from array import array
+from machine import Pin
+from math import pi
+from time import sleep_ms, ticks_diff, ticks_ms
+from utils.config import WIND_SAMPLE_SECONDS
+from utils.constants import (
+    WIND_EDGE_BUFFER_SIZE,
+    WIND_FACTOR,
+    WIND_GUST_STEP_MS,
+    WIND_GUST_WINDOW_MS,
+    WIND_RADIUS_CM,
+    WIND_SPEED_PIN,
+)
+
+
+class Anemometer:
+    """
+    Counts anemometer pulses in the background using a pin interrupt.
+
+    The time of every change in the anemometer output is stored in a preallocated
+    buffer, so sampling carries on while other work runs and wind speed, gust and lull
+    can all be calculated from the same sample
+    """
+
+    def __init__(self):
+        self.__pin = Pin(WIND_SPEED_PIN, Pin.IN, Pin.PULL_UP)
+        self.__edges = array("L", bytearray(WIND_EDGE_BUFFER_SIZE * 4))
+        self.__edge_count = 0
+        self.__start = None
+        self.__end = None
+
+    def __edge_callback(self, pin):
+        """
+        Records the time of a change in anemometer output. Must not allocate as it runs
+        in interrupt context
+
+        Args:
+            pin (Pin): The Pin object passed as part of the Pin interrupt callback
+        """
+        self.__edges[self.__edge_count % WIND_EDGE_BUFFER_SIZE] = ticks_ms()
+        self.__edge_count += 1
+
+    def start(self):
+        """
+        Start counting anemometer pulses in the background
+        """
+        self.__edge_count = 0
+        self.__start = ticks_ms()
+        self.__end = None
+        # A hard interrupt runs straight away, so edges are timed when they happen and
+        # aren't delayed or dropped while other code is running
+        self.__pin.irq(
+            trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING,
+            handler=self.__edge_callback,
+            hard=True,
+        )
+
+    def stop(self):
+        """
+        Stop counting anemometer pulses
+        """
+        self.__pin.irq(handler=None)
+        if self.__end is None:
+            self.__end = ticks_ms()
+
+    def remaining_ms(self):
+        """
+        Get how long is left until the full sample window has been counted
+
+        Returns:
+            int: ms remaining in the sample window, 0 if complete
+        """
+        if self.__start is None:
+            return 0
+        elapsed = ticks_diff(ticks_ms(), self.__start)
+        return max(0, WIND_SAMPLE_SECONDS * 1000 - elapsed)
+
+    def __speed(self, edges, duration_ms):
+        """
+        Convert a number of anemometer output changes into a wind speed
+
+        Args:
+            edges (int): Number of output changes counted
+            duration_ms (int): ms the changes were counted over
+
+        Returns:
+            float: wind speed in m/s
+        """
+        if duration_ms <= 0:
+            return 0
+        # Work out the rotation speed in Hz (2 changes per rotation)
+        rotation_hz = (edges / 2) / (duration_ms / 1000)
+        # Calculate the wind speed in metres per second
+        circumference = WIND_RADIUS_CM * 2.0 * pi
+        return rotation_hz * circumference * WIND_FACTOR
+
+    def __window_edges(self):
+        """
+        Get the times of output changes in the sample window, oldest first
+
+        Returns:
+            list, int: ms offsets of changes from window start, window length in ms
+        """
+        duration = ticks_diff(self.__end, self.__start)
+        stored = min(self.__edge_count, WIND_EDGE_BUFFER_SIZE)
+        first = self.__edge_count - stored
+
+        # If the buffer overflowed, only the most recent changes are available
+        # so shorten the window to match
+        window_start = self.__start
+        if first > 0:
+            window_start = self.__edges[first % WIND_EDGE_BUFFER_SIZE]
+            duration = ticks_diff(self.__end, window_start)
+
+        offsets = [
+            ticks_diff(self.__edges[i % WIND_EDGE_BUFFER_SIZE], window_start)
+            for i in range(first, self.__edge_count)
+        ]
+        return offsets, duration
+
+    def get_wind(self):
+        """
+        Calculate wind speed, gust and lull from the anemometer sample.
+
+        Waits for the rest of the sample window if it isn't complete yet. The gust and
+        lull are the highest and lowest average speeds over any WIND_GUST_WINDOW_MS
+        period within the sample, or the mean speed if the sample is shorter than that
+
+        Returns:
+            float, float, float: mean wind speed, gust and lull in m/s
+        """
+        remaining = self.remaining_ms()
+        if remaining:
+            sleep_ms(remaining)
+        self.stop()
+
+        offsets, duration = self.__window_edges()
+        mean = self.__speed(len(offsets), duration)
+
+        if duration < WIND_GUST_WINDOW_MS:
+            return mean, mean, mean
+
+        # Slide a gust window across the sample, counting the changes within it
+        gust = None
+        lull = None
+        first = 0
+        last = 0
+        last_start = duration - WIND_GUST_WINDOW_MS
+        for window_start in range(0, last_start + 1, WIND_GUST_STEP_MS):
+            window_end = window_start + WIND_GUST_WINDOW_MS
+            while first < len(offsets) and offsets[first] < window_start:
+                first += 1
+            while last < len(offsets) and offsets[last] < window_end:
+                last += 1
+            speed = self.__speed(last - first, WIND_GUST_WINDOW_MS)
+            gust = speed if gust is None else max(gust, speed)
+            lull = speed if lull is None else min(lull, speed)
+
+        return mean, gust, lull
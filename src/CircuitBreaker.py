@@ -0,0 +1,112 @@
+from utils.config import (
+    UPLOAD_BACKOFF_BASE_MINUTES,
+    UPLOAD_BACKOFF_MAX_MINUTES,
+    UPLOAD_BREAKER_THRESHOLD,
+)
+from utils.constants import (
+    BREAKER_CLOSED,
+    BREAKER_HALF_OPEN,
+    BREAKER_OPEN,
+    BREAKER_STATE_NAMES,
+)
+from utils.clock import iso, now
+
+
+class CircuitBreaker:
+    """
+    Decides whether uploads should be attempted, so wakes don't keep powering up wifi
+    while the upload endpoint is down.
+
+    Closed is normal operation. After UPLOAD_BREAKER_THRESHOLD upload sessions fail
+    in a row the breaker opens and uploads are skipped until a backoff period has
+    passed, doubling with each further failure up to UPLOAD_BACKOFF_MAX_MINUTES.
+    Once it's passed the breaker goes half open, allowing a single probe request;
+    if that succeeds the breaker closes, otherwise it opens again.
+
+    Kept in persistent state so it carries across wakes
+
+    Args:
+        logger (Logging): Logging controller for logging info to file
+        state (State): Persistent state, used to keep the breaker state between wakes
+    """
+
+    def __init__(self, logger, state):
+        self.__logger = logger
+        self.__state = state
+
+    def allow(self):
+        """
+        Check whether an upload should be attempted now, moving from open to half
+        open if the backoff period has passed
+
+        Returns:
+            bool: True if an upload should be attempted
+        """
+        if self.__state["upload_breaker"] == BREAKER_OPEN:
+            retry_at = self.__state["upload_retry_at"]
+            if now() < retry_at:
+                self.__logger.info(
+                    "Upload endpoint backing off, next attempt after {}", iso(retry_at)
+                )
+                return False
+            self.__set(BREAKER_HALF_OPEN)
+        return True
+
+    def is_probing(self):
+        """
+        Check whether the next upload is a probe, so should be kept to a single request
+
+        Returns:
+            bool: True if half open
+        """
+        return self.__state["upload_breaker"] == BREAKER_HALF_OPEN
+
+    def record_success(self):
+        """
+        Record an upload session that succeeded, closing the breaker
+        """
+        self.__state["upload_failures"] = 0
+        if self.__state["upload_breaker"] != BREAKER_CLOSED:
+            self.__set(BREAKER_CLOSED)
+
+    def record_failure(self):
+        """
+        Record an upload session that failed, opening the breaker if there have been
+        too many failures in a row or the probe failed
+        """
+        failures = min(self.__state["upload_failures"] + 1, 0xFFFF)
+        self.__state["upload_failures"] = failures
+
+        if (
+            self.__state["upload_breaker"] == BREAKER_CLOSED
+            and failures < UPLOAD_BREAKER_THRESHOLD
+        ):
+            return
+
+        # Double the backoff for every failure past the threshold
+        doublings = min(max(0, failures - UPLOAD_BREAKER_THRESHOLD), 16)
+        minutes = min(
+            UPLOAD_BACKOFF_BASE_MINUTES * (1 << doublings), UPLOAD_BACKOFF_MAX_MINUTES
+        )
+        self.__state["upload_retry_at"] = now() + minutes * 60
+        if self.__state["upload_breaker"] != BREAKER_OPEN:
+            self.__set(BREAKER_OPEN)
+        self.__logger.warn(
+            "- {} failed upload(s) in a row, backing off for {} minutes",
+            failures,
+            minutes,
+        )
+
+    def __set(self, breaker_state):
+        """
+        Change the breaker state
+
+        Args:
+            breaker_state (int): New breaker state as defined in utils.constants
+        """
+        self.__logger.info(
+            "- Upload circuit breaker {} -> {}",
+            BREAKER_STATE_NAMES[self.__state["upload_breaker"]],
+            BREAKER_STATE_NAMES[breaker_state],
+        )
+        self.__state["upload_breaker"] = breaker_state
@@ -0,0 +1,119 @@
+from Logging import LOG_LEVELS
+from utils.config import (
+    ENERGY_CONSERVE_VOLTAGE,
+    ENERGY_LOG_LEVELS,
+    ENERGY_READING_SCALE,
+    ENERGY_SURVIVAL_VOLTAGE,
+    ENERGY_UPLOAD_SCALE,
+    LOG_FILE_LEVEL,
+)
+from utils.constants import (
+    ENERGY_CONSERVE,
+    ENERGY_HYSTERESIS,
+    ENERGY_NORMAL,
+    ENERGY_SMOOTHING,
+    ENERGY_SURVIVAL,
+    ENERGY_TIER_NAMES,
+)
+
+
+class EnergyPolicy:
+    """
+    Decides how hard the board works based on the battery voltage.
+
+    Keeps a smoothed voltage in persistent state so one noisy reading can't change
+    anything, and picks an energy tier from it. Lower tiers take readings less often,
+    upload less often, and save fewer log entries. Tiers only go back up once the
+    voltage has recovered a little past the threshold, so the board doesn't flap
+    between them
+
+    Args:
+        logger (Logging): Logging controller, which also has its file level set
+        state (State): Persistent state, used to keep the smoothed voltage and tier
+    """
+
+    def __init__(self, logger, state):
+        self.__logger = logger
+        self.__state = state
+        self.__apply_log_level()
+
+    def tier(self):
+        """
+        Get the energy tier currently in use
+
+        Returns:
+            int: Energy tier as defined in utils.constants
+        """
+        return self.__state["energy_tier"]
+
+    def reading_scale(self):
+        """
+        Get how much to stretch the time between readings in the current tier
+
+        Returns:
+            int: How many times longer to leave between readings
+        """
+        return ENERGY_READING_SCALE[self.tier()]
+
+    def upload_scale(self):
+        """
+        Get how much to stretch the time between uploads in the current tier, on top
+        of the time between readings
+
+        Returns:
+            int: How many times more readings to wait for between uploads
+        """
+        return ENERGY_UPLOAD_SCALE[self.tier()]
+
+    def update(self, voltage):
+        """
+        Add a new voltage reading to the smoothed voltage, changing tier if needed
+
+        Args:
+            voltage (float): Battery voltage just read
+        """
+        smoothed = self.__state["voltage_smoothed"]
+        if not smoothed:
+            smoothed = voltage
+        else:
+            smoothed += ENERGY_SMOOTHING * (voltage - smoothed)
+        self.__state["voltage_smoothed"] = smoothed
+
+        tier = self.tier()
+        # Drop straight to whichever tier the voltage is in, but only go back up once
+        # it has recovered past the threshold by the hysteresis margin
+        if smoothed < ENERGY_SURVIVAL_VOLTAGE:
+            new_tier = ENERGY_SURVIVAL
+        elif smoothed < ENERGY_CONSERVE_VOLTAGE:
+            new_tier = ENERGY_CONSERVE
+        else:
+            new_tier = ENERGY_NORMAL
+        if new_tier < tier:
+            threshold = (
+                ENERGY_SURVIVAL_VOLTAGE
+                if tier == ENERGY_SURVIVAL
+                else ENERGY_CONSERVE_VOLTAGE
+            )
+            if smoothed < threshold + ENERGY_HYSTERESIS:
+                new_tier = tier
+
+        self.__logger.debug("Smoothed voltage: {}", smoothed)
+        if new_tier != tier:
+            self.__logger.warn(
+                "Energy tier {} -> {} (smoothed voltage {})",
+                ENERGY_TIER_NAMES[tier],
+                ENERGY_TIER_NAMES[new_tier],
+                round(smoothed, 2),
+            )
+            self.__state["energy_tier"] = new_tier
+            self.__apply_log_level()
+
+    def __apply_log_level(self):
+        """
+        Set the log file level for the current tier, never saving more than the
+        configured LOG_FILE_LEVEL would
+        """
+        level = ENERGY_LOG_LEVELS[self.tier()] or LOG_FILE_LEVEL
+        if LOG_LEVELS.index(level) < LOG_LEVELS.index(LOG_FILE_LEVEL):
+            level = LOG_FILE_LEVEL
+        self.__logger.set_levels(file_level=level)
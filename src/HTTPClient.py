@@ -0,0 +1,512 @@
+from usocket import getaddrinfo, socket, SOCK_STREAM
+from ussl import wrap_socket
+from io import IOBase
+from time import ticks_diff, ticks_us
+from ujson import loads
+from utils.constants import (
+    HTTP_BUFFER_SIZE,
+    HTTP_COMPRESSION_WBITS,
+    HTTP_TIMEOUT_SECONDS,
+)
+
+# Compression needs firmware with the deflate module
+try:
+    from deflate import DeflateIO, GZIP
+except ImportError:
+    DeflateIO = None
+
+# Only newer firmware allows Nagle's algorithm to be turned off
+try:
+    from usocket import IPPROTO_TCP, TCP_NODELAY
+except ImportError:
+    TCP_NODELAY = None
+
+
+class ConnectionClosed(OSError):
+    """
+    Raised when the server closes the connection before sending any response
+    """
+
+
+class Response:
+    """
+    Response to a request made by HTTPClient. Has the same attributes as a urequests
+    response so it can be used in the same way
+
+    Attributes:
+        status_code (int): HTTP status code
+        reason (str): HTTP status reason phrase
+        headers (dict): Response headers, with lower case names
+        content (bytes): Response body
+    """
+
+    def __init__(self, status_code, reason, headers, content):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def json(self):
+        return loads(self.content)
+
+    def close(self):
+        # The body has already been read, and the connection belongs to the client
+        pass
+
+
+class WriteStream(IOBase):
+    """
+    Stream which passes everything written to it on to a function, so a body writer
+    can be written to through a DeflateIO
+
+    Args:
+        write (function): Called with everything written to the stream
+    """
+
+    def __init__(self, write):
+        self.__write = write
+
+    def write(self, data):
+        self.__write(data)
+        return len(data)
+
+
+class HTTPClient:
+    """
+    Minimal HTTP/1.1 client that keeps one connection to a server open across
+    requests, so DNS lookup, TCP setup and any TLS handshake only happen once per
+    session rather than once per request.
+
+    If the server has closed the connection since the last request, it's reopened and
+    the request is retried once. Requests which were sent but got no response in time
+    aren't retried, as the server may still have received them.
+
+    Request bodies can be given as a function that writes the body in pieces, so the
+    whole body never has to be held in memory. By default the function is called
+    once to work out the Content-Length and again to send the body through a small
+    reusable buffer. Servers which accept chunked transfer encoding can be sent the
+    body in chunks instead, so it's only produced once. Bodies can also be gzip
+    compressed on the fly if the firmware supports it
+
+    Args:
+        url (str): Base URL of the server, requests are made to its path
+        profiler (Profiler): Profiler to sample heap usage with each time the send
+        buffer is sent, if any
+
+    Attributes:
+        connections (int): Number of connections opened so far
+        requests (int): Number of requests completed so far
+        body_bytes (int): Total size of request bodies before any compression
+        sent_bytes (int): Total size of request bodies actually sent
+        compress_ms (int): Total time spent compressing request bodies in ms
+    """
+
+    def __init__(self, url, profiler=None):
+        proto, _, host, path = (url + "/").split("/", 3)
+        self.__tls = proto == "https:"
+        self.__host = host
+        self.__path = "/" + path[:-1] if path else "/"
+        self.__port = 443 if self.__tls else 80
+        if ":" in host:
+            host, port = host.split(":", 1)
+            self.__port = int(port)
+        self.__hostname = host
+        self.__profiler = profiler
+        self.__addr = None
+        self.__sock = None
+        self.__buf = bytearray(HTTP_BUFFER_SIZE)
+        self.__buf_len = 0
+        self.__chunk = bytearray(HTTP_BUFFER_SIZE)
+        self.__chunk_len = 0
+        self.__body_len = 0
+        self.__raw_len = 0
+        self.__compress_us = 0
+        self.connections = 0
+        self.requests = 0
+        self.body_bytes = 0
+        self.sent_bytes = 0
+        self.compress_ms = 0
+
+    @staticmethod
+    def can_compress():
+        """
+        Check if request bodies can be compressed
+
+        Returns:
+            bool: True if the firmware has the deflate module
+        """
+        return DeflateIO is not None
+
+    def __open(self):
+        """
+        Open a new connection to the server, looking up its address the first time
+        """
+        if self.__addr is None:
+            info = getaddrinfo(self.__hostname, self.__port, 0, SOCK_STREAM)
+            self.__addr = info[0][-1]
+
+        sock = socket()
+        try:
+            sock.settimeout(HTTP_TIMEOUT_SECONDS)
+            # Bodies are sent in several writes, so don't hold the last one back
+            # waiting for the server to acknowledge the others
+            if TCP_NODELAY is not None:
+                sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+            sock.connect(self.__addr)
+            if self.__tls:
+                sock = wrap_socket(sock, server_hostname=self.__hostname)
+        except OSError:
+            sock.close()
+            raise
+        self.__sock = sock
+        self.connections += 1
+
+    def close(self):
+        """
+        Close the connection to the server, if open
+        """
+        if self.__sock is not None:
+            try:
+                self.__sock.close()
+            except OSError:
+                pass
+            self.__sock = None
+
+    def __count(self, data):
+        """
+        Count the length of a piece of request body without sending it
+
+        Args:
+            data (bytes or str): Piece of request body
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        self.__body_len += len(data)
+
+    def __write(self, data):
+        """
+        Send a piece of request body through the send buffer
+
+        Args:
+            data (bytes or str): Piece of request body
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        self.__body_len += len(data)
+        self.__write_raw(data)
+
+    def __write_chunked(self, data):
+        """
+        Add a piece of request body to the current chunk, sending the chunk whenever
+        it fills up
+
+        Args:
+            data (bytes or str): Piece of request body
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        self.__body_len += len(data)
+
+        chunk = self.__chunk
+        view = memoryview(data)
+        while len(view):
+            length = min(len(view), len(chunk) - self.__chunk_len)
+            chunk[self.__chunk_len : self.__chunk_len + length] = view[:length]
+            self.__chunk_len += length
+            view = view[length:]
+            if self.__chunk_len == len(chunk):
+                self.__write_chunk()
+
+    def __write_chunk(self):
+        """
+        Send the current chunk of request body, with its chunked encoding framing,
+        through the send buffer
+        """
+        if self.__chunk_len:
+            self.__write_raw(f"{self.__chunk_len:x}\r\n")
+            self.__write_raw(memoryview(self.__chunk)[: self.__chunk_len])
+            self.__write_raw(b"\r\n")
+            self.__chunk_len = 0
+
+    def __write_raw(self, data):
+        """
+        Send data through the send buffer, sending the buffer whenever it fills up
+
+        Args:
+            data (bytes, memoryview or str): Data to send
+        """
+        if isinstance(data, str):
+            data = data.encode()
+
+        buf = self.__buf
+        view = memoryview(data)
+        while len(view):
+            length = min(len(view), len(buf) - self.__buf_len)
+            buf[self.__buf_len : self.__buf_len + length] = view[:length]
+            self.__buf_len += length
+            view = view[length:]
+            if self.__buf_len == len(buf):
+                self.__flush()
+
+    def __flush(self):
+        """
+        Send anything in the send buffer
+        """
+        if self.__buf_len:
+            self.__sock.write(memoryview(self.__buf)[: self.__buf_len])
+            self.__buf_len = 0
+            if self.__profiler is not None:
+                self.__profiler.sample()
+
+    def __compressor(self, write_body):
+        """
+        Wrap a body writer so the body it writes is gzip compressed
+
+        Args:
+            write_body (function): Writes the uncompressed body using the function
+            passed to it
+
+        Returns:
+            function: Writes the compressed body using the function passed to it
+        """
+
+        def write_compressed(write):
+            self.__raw_len = 0
+            self.__compress_us = 0
+            compressor = DeflateIO(WriteStream(write), GZIP, HTTP_COMPRESSION_WBITS)
+
+            def write_piece(data):
+                if isinstance(data, str):
+                    data = data.encode()
+                start = ticks_us()
+                compressor.write(data)
+                self.__compress_us += ticks_diff(ticks_us(), start)
+                self.__raw_len += len(data)
+
+            write_body(write_piece)
+            # Closing writes out the rest of the compressed data and the gzip trailer
+            start = ticks_us()
+            compressor.close()
+            self.__compress_us += ticks_diff(ticks_us(), start)
+
+        return write_compressed
+
+    def __send(self, method, write_body, headers, compress, chunked):
+        """
+        Send a request over the open connection
+
+        Args:
+            method (str): HTTP method
+            write_body (function): Writes the request body using the function passed
+            to it. Unless chunked, must write exactly the same body each time it's
+            called
+            headers (dict): Extra request headers
+            compress (bool): True if the body is being compressed
+            chunked (bool): Send the body with chunked transfer encoding
+
+        Raises:
+            ValueError: If the body changed between working out its length and
+            sending it
+        """
+        length = None
+        compress_us = 0
+        if not chunked:
+            self.__body_len = 0
+            write_body(self.__count)
+            length = self.__body_len
+            raw_len = self.__raw_len
+            compress_us = self.__compress_us
+
+        head = f"{method} {self.__path} HTTP/1.1\r\nHost: {self.__host}\r\n"
+        if chunked:
+            head += "Transfer-Encoding: chunked\r\n"
+        else:
+            head += f"Content-Length: {length}\r\n"
+        for name, value in headers.items():
+            head += f"{name}: {value}\r\n"
+        head += "\r\n"
+
+        # The head and start of the body go out together through the buffer, as
+        # separate small writes get held up waiting for the server to acknowledge
+        # the previous one
+        self.__buf_len = 0
+        self.__chunk_len = 0
+        self.__body_len = 0
+        self.__write_raw(head)
+        if chunked:
+            write_body(self.__write_chunked)
+            self.__write_chunk()
+            self.__write_raw(b"0\r\n\r\n")
+            raw_len = self.__raw_len
+        else:
+            write_body(self.__write)
+        self.__flush()
+
+        if length is not None and self.__body_len != length:
+            raise ValueError("Request body changed while it was being sent")
+
+        self.body_bytes += raw_len if compress else self.__body_len
+        self.sent_bytes += self.__body_len
+        if compress:
+            self.compress_ms += (compress_us + self.__compress_us) // 1000
+
+    def __read_exactly(self, length):
+        """
+        Read an exact number of bytes from the connection
+
+        Args:
+            length (int): Number of bytes to read
+
+        Returns:
+            bytes: Data read
+
+        Raises:
+            OSError: If the connection closes before all the data is read
+        """
+        chunks = []
+        while length > 0:
+            chunk = self.__sock.read(length)
+            if not chunk:
+                raise OSError("Connection closed mid response")
+            chunks.append(chunk)
+            length -= len(chunk)
+        return b"".join(chunks)
+
+    def __read_chunked(self):
+        """
+        Read a body sent with chunked transfer encoding
+
+        Returns:
+            bytes: Body content
+        """
+        chunks = []
+        while True:
+            size = int(self.__sock.readline().split(b";", 1)[0], 16)
+            if size == 0:
+                break
+            chunks.append(self.__read_exactly(size))
+            self.__sock.readline()
+
+        # Skip any trailers
+        while self.__sock.readline() not in (b"\r\n", b""):
+            pass
+        return b"".join(chunks)
+
+    def __read_response(self):
+        """
+        Read a response from the open connection, closing the connection afterwards
+        if the server doesn't want to keep it alive
+
+        Returns:
+            Response: The response
+
+        Raises:
+            ConnectionClosed: If the connection was closed before a response was
+            received
+            OSError: If reading the response failed, e.g. timed out
+        """
+        status_line = self.__sock.readline()
+        if not status_line:
+            raise ConnectionClosed("Connection closed by server")
+        version, status, reason = (status_line.decode().rstrip() + " ").split(" ", 2)
+
+        headers = {}
+        while True:
+            line = self.__sock.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode().partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" and (
+            version != "HTTP/1.0" or connection == "keep-alive"
+        )
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            content = self.__read_chunked()
+        elif "content-length" in headers:
+            content = self.__read_exactly(int(headers["content-length"]))
+        else:
+            # Without a length the body runs until the server closes the connection
+            content = self.__sock.read()
+            keep_alive = False
+
+        if not keep_alive:
+            self.close()
+        return Response(int(status), reason.strip(), headers, content)
+
+    def request(self, method, body=b"", headers={}, compress=False, chunked=False):
+        """
+        Make a request, opening a connection if there isn't one already
+
+        Args:
+            method (str): HTTP method
+            body (bytes, str or function): Request body, or a function that writes
+            the request body in pieces using the function passed to it
+            headers (dict): Extra request headers
+            compress (bool): Gzip compress the body, if the firmware supports it.
+            Without chunked, the body is compressed twice, once to work out its length
+            chunked (bool): Send the body with chunked transfer encoding rather than
+            working out its length first. The server must support it
+
+        Returns:
+            Response: The response
+
+        Raises:
+            OSError: On connection failure
+        """
+        write_body = body
+        if not callable(body):
+            write_body = lambda write: write(body)
+
+        compress = compress and self.can_compress()
+        if compress:
+            write_body = self.__compressor(write_body)
+            headers = dict(headers)
+            headers["Content-Encoding"] = "gzip"
+
+        while True:
+            reused = self.__sock is not None
+            if not reused:
+                self.__open()
+            sent = False
+            try:
+                self.__send(method, write_body, headers, compress, chunked)
+                sent = True
+                res = self.__read_response()
+                self.requests += 1
+                return res
+            except Exception as x:
+                # Never leave a half sent request on the connection
+                self.close()
+                # An idle connection may have been closed by the server, so try again
+                # on a fresh one, but don't retry if that fails too. Once the request
+                # has been sent, only retry if the server closed the connection
+                # without responding, as otherwise it may have been received, e.g.
+                # if the response timed out
+                stale = isinstance(x, ConnectionClosed) or (
+                    not sent and isinstance(x, OSError)
+                )
+                if not reused or not stale:
+                    raise
+
+    def post(self, body, headers={}, compress=False, chunked=False):
+        """
+        Make a POST request
+
+        Args:
+            body (bytes, str or function): Request body, see request()
+            headers (dict): Extra request headers
+            compress (bool): Gzip compress the body, see request()
+            chunked (bool): Send the body with chunked transfer encoding, see
+            request()
+
+        Returns:
+            Response: The response
+        """
+        return self.request("POST", body, headers, compress, chunked)
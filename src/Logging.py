@@ -1,16 +1,34 @@
 from os import stat, remove, rename
-from utils.datetime_string import datetime_string
+from utils.config import LOG_BUFFER_SIZE, LOG_CONSOLE_LEVEL, LOG_FILE_LEVEL
+from utils.clock import iso
+
+# Logging levels in order of severity
+LOG_LEVELS = ("debug", "info", "warn", "error", "exception")
 
 
 class Logging:
-    """Handles logging info/warnings/errors/etc to log file"""
+    """
+    Handles logging info/warnings/errors/etc to log file
+
+    Args:
+      state (State): Persistent state, used to keep track of shipped log entries
+      profiler (Profiler): Profiler to time log rotation and sample heap usage with
+    """
 
-    def __init__(self):
-        # values for keeping log file from taking up too much space, in bytes
-        self.__truncate_at = 11 * 1024
-        self.__truncate_to = 8 * 1024
-        # name of log file
+    def __init__(self, state, profiler):
+        # values for keeping log files from taking up too much space. The log is split
+        # into this many segments, each rotated out once it reaches this size in bytes
+        self.__segment_count = 3
+        self.__segment_size = 4 * 1024
+        # name of active log file, older segments are named log.1.txt, log.2.txt etc.
         self.__log_file = "log.txt"
+        self.__state = state
+        self.__profiler = profiler
+        # log entries waiting to be written to the log file, and their total size
+        self.__buffer = []
+        self.__buffered = 0
+        # minimum levels of entries to print to the console and save to the log file
+        self.set_levels(LOG_CONSOLE_LEVEL, LOG_FILE_LEVEL)
 
     def __log_size(self, file):
         """
@@ -28,107 +46,322 @@ class Logging:
         except OSError:
             return None
 
-    def __truncate(self, file, target_size):
+    def __segment_file(self, index):
         """
-        Truncate log file to desired size
+        Get the filename of a log segment
 
         Args:
-          file (str): Filename of log file
-          target_size (int): Desired size of log file in bytes
+          index (int): Age of the segment, 0 being the active log file
+
+        Returns:
+          str: Filename of the segment
         """
-        cur_size = self.__log_size(file)
+        if index == 0:
+            return self.__log_file
+        return self.__log_file.replace(".txt", f".{index}.txt")
 
-        # figure out how many bytes to remove from log file
-        discard_size = cur_size - target_size
-        if discard_size <= 0:
-            return
+    def __rotate(self):
+        """
+        Rotate the active log file out into the older segments, discarding the
+        oldest segment. Only renames files, so costs the same however big the log is
+        """
+        size = self.__log_size(self.__log_file)
+        oldest = self.__segment_file(self.__segment_count - 1)
+        if self.__log_size(oldest) is not None:
+            remove(oldest)
+
+        for index in range(self.__segment_count - 2, -1, -1):
+            if self.__log_size(self.__segment_file(index)) is not None:
+                rename(self.__segment_file(index), self.__segment_file(index + 1))
+
+        # the next active log file starts where the rotated one ended
+        cursor, base = self.__read_cursor()
+        self.__write_cursor(cursor, base + size)
+
+    def __segments(self):
+        """
+        Get the log segments that exist, oldest first, along with where each one starts
+        in the log as a whole
+
+        Returns:
+          list: (filename, start offset, size) of each segment
+        """
+        cursor, start = self.__read_cursor()
+        segments = []
+        for index in range(self.__segment_count):
+            file = self.__segment_file(index)
+            size = self.__log_size(file)
+            # the active log file won't exist again until the first entry after rotating
+            if size is None and index == 0:
+                continue
+            if size is None:
+                break
+            # segments are contiguous, so each older one ends where the next starts
+            if index > 0:
+                start -= size
+            segments.insert(0, (file, start, size))
+        return segments
+
+    def __read_cursor(self):
+        """
+        Get the position in the log up to which logs have been shipped, and the
+        position in the log the active log file starts at.
+
+        Positions count every byte ever logged, so they aren't affected by rotation
+
+        Returns:
+          int, int: Shipped position, Start position of the active log file
+        """
+        return self.__state["log_cursor"], self.__state["log_base"]
+
+    def __write_cursor(self, position, base):
+        """
+        Update the position in the log up to which logs have been shipped, and the
+        position in the log the active log file starts at. Saved along with the rest
+        of the persistent state at the end of the wake
+
+        Args:
+          position (int): Shipped position
+          base (int): Start position of the active log file
+        """
+        self.__state["log_cursor"] = position
+        self.__state["log_base"] = base
+
+    def __line_level(self, line):
+        """
+        Get the logging level of a line from the log file
+
+        Args:
+          line (bytes): Line read from the log file
+
+        Returns:
+          int: Index of the line's level in LOG_LEVELS
+          None: If the line is a continuation of a multi-line entry
+        """
+        # level tag sits after the 20 character datetime, right aligned to 12 characters
+        tag = line[21:33].strip()
+        if tag.startswith(b"[") and tag.endswith(b"]:"):
+            level = tag[1:-2].decode()
+            if level in LOG_LEVELS:
+                return LOG_LEVELS.index(level)
+        return None
+
+    def unshipped(self):
+        """
+        Get the range of log entries which haven't been shipped yet.
+
+        Positions are fixed once returned, so entries logged afterwards won't be
+        included when writing out the range
+
+        Returns:
+          int, int: Start position, End position to pass to `mark_shipped` once sent
+        """
+        self.flush()
+        cursor = self.__read_cursor()[0]
+        segments = self.__segments()
+        if not segments:
+            return cursor, cursor
+
+        # If the cursor is past the end of the log, it has been replaced so start over
+        end = segments[-1][1] + segments[-1][2]
+        if cursor > end:
+            cursor = 0
+        return cursor, end
+
+    def write_entries(self, write, start, end, min_level="debug"):
+        """
+        Write out log entries between two positions a line at a time, stitched
+        together from every log segment, so the entries never have to be held in
+        memory all at once
 
-        with open(file, "rb") as in_file:
-            with open(file + ".tmp", "wb") as out_file:
-                # skip through input file until discard enough
-                while discard_size > 0:
-                    chunk = in_file.read(1024)
-                    discard_size -= len(chunk)
-
-                # find a line break nearby
-                break_pos = max(
-                    chunk.find(b"\n", -discard_size), chunk.rfind(b"\n", -discard_size)
-                )
-                if break_pos != -1:
-                    out_file.write(chunk[break_pos + 1 :])
-
-                # copy rest of file
-                while True:
-                    chunk = in_file.read(1024)
-                    if not chunk:
+        Args:
+          write (function): Called with each line of the entries, as bytes
+          start (int): Position to start from, as returned by `unshipped`
+          end (int): Position to stop at, as returned by `unshipped`
+          min_level (str): Only include entries at this level or above
+        """
+        min_index = LOG_LEVELS.index(min_level)
+        keep = True
+        for file, seg_start, size in self.__segments():
+            if seg_start + size <= start or seg_start >= end:
+                continue
+            with open(file, "rb") as logfile:
+                self.__profiler.sample()
+                position = max(start, seg_start)
+                logfile.seek(position - seg_start)
+                while position < end:
+                    line = logfile.readline()
+                    if not line:
                         break
-                    out_file.write(chunk)
+                    position += len(line)
+                    # Lines without a level belong to the entry before them
+                    level = self.__line_level(line)
+                    if level is not None:
+                        keep = level >= min_index
+                    if keep:
+                        write(line)
 
-        # delete old file and replace with new
-        remove(file)
-        rename(file + ".tmp", file)
+    def mark_shipped(self, position):
+        """
+        Mark log entries up to a position as shipped so they aren't sent again
 
-    def __log(self, level, text):
+        Args:
+          position (int): End position returned by `unshipped`
         """
-        Save logging data to log file
+        self.__write_cursor(position, self.__read_cursor()[1])
+
+    def flush(self):
+        """
+        Write any buffered log entries to the log file in one go.
+
+        Must be called before power is cut, otherwise buffered entries are lost
+        """
+        if not self.__buffer:
+            return
+
+        with open(self.__log_file, "a") as logfile:
+            for log_entry in self.__buffer:
+                logfile.write(log_entry)
+        self.__buffer = []
+        self.__buffered = 0
+
+        # if log file is getting too big, rotate it out
+        if (self.__log_size(self.__log_file) or 0) >= self.__segment_size:
+            with self.__profiler.phase("rotate"):
+                self.__rotate()
+
+    def is_enabled(self, level):
+        """
+        Check if entries at a level are printed or saved, e.g. to skip gathering
+        information for an entry that would be dropped
 
         Args:
-          level (str): logging level such as debug, error, etc
-          text (str): content of log
+          level (str): Logging level e.g. "debug"
+
+        Returns:
+          bool: True if entries at the level are printed or saved
+        """
+        return LOG_LEVELS.index(level) >= self.__min_level
+
+    def set_levels(self, console_level=None, file_level=None):
         """
-        datetime = datetime_string()
+        Set the minimum level of entries printed to the console and saved to the
+        log file
+
+        Args:
+          console_level (str): Minimum level printed to the console, unchanged if None
+          file_level (str): Minimum level saved to the log file, unchanged if None
+        """
+        if console_level is not None:
+            self.__console_level = LOG_LEVELS.index(console_level)
+        if file_level is not None:
+            self.__file_level = LOG_LEVELS.index(file_level)
+        self.__min_level = min(self.__console_level, self.__file_level)
+
+    def __format(self, items):
+        """
+        Render logging info into the text of a log entry.
+
+        If the first item is a string containing {} placeholders, it's formatted with
+        the rest of the items, otherwise all items are converted to strings and joined.
+        If formatting fails, e.g. on a literal brace, the items are joined instead so
+        a bad log call can never abort the wake
+
+        Args:
+          items (tuple): logging info passed to one of the logging methods
+
+        Returns:
+          str: content of log
+        """
+        if len(items) > 1 and isinstance(items[0], str) and "{" in items[0]:
+            try:
+                return items[0].format(*items[1:])
+            except (KeyError, IndexError, ValueError):
+                pass
+        return " ".join(map(str, items))
+
+    def __log(self, level, items):
+        """
+        Save logging data to log file.
+
+        Entries below both the console and file levels are dropped before any
+        formatting is done, so they cost next to nothing
+
+        Args:
+          level (int): index in LOG_LEVELS of the logging level e.g. debug, error
+          items (tuple): logging info to be formatted into the content of the log
+        """
+        if level < self.__min_level:
+            return
+
+        datetime = iso()
         # append datetime string to log entry
-        log_entry = "{0} {1:>12} {2}".format(datetime, "[" + level + "]:", text)
-        print(log_entry)
-        # write to file with newline
-        with open(self.__log_file, "a") as logfile:
-            logfile.write(log_entry + "\n")
+        log_entry = "{0} {1:>12} {2}".format(
+            datetime, "[" + LOG_LEVELS[level] + "]:", self.__format(items)
+        )
+        if level >= self.__console_level:
+            print(log_entry)
+
+        if level < self.__file_level:
+            return
 
-        # if log file is getting too big, truncate
-        if self.__truncate_at and self.__log_size(self.__log_file):
-            self.__truncate(self.__log_file, self.__truncate_to)
+        # buffer entry with newline, only writing to file once the buffer is full
+        self.__buffer.append(log_entry + "\n")
+        self.__buffered += len(log_entry) + 1
+        if self.__buffered >= LOG_BUFFER_SIZE:
+            self.flush()
 
     def debug(self, *items):
         """
         Logs at debug level
 
         Args:
-          *items: logging info which will be converted to strings and saved
+          *items: logging info which will be converted to strings and saved. Can also be
+            a format string followed by its arguments, which are only formatted if the
+            entry is going to be printed or saved
         """
-        self.__log("debug", " ".join(map(str, items)))
+        self.__log(0, items)
 
     def info(self, *items):
         """
         Logs at info level
 
         Args:
-          *items: logging info which will be converted to strings and saved
+          *items: logging info which will be converted to strings and saved. Can also be
+            a format string followed by its arguments, which are only formatted if the
+            entry is going to be printed or saved
         """
-        self.__log("info", " ".join(map(str, items)))
+        self.__log(1, items)
 
     def warn(self, *items):
         """
         Logs at warn level
 
         Args:
-          *items: logging info which will be converted to strings and saved
+          *items: logging info which will be converted to strings and saved. Can also be
+            a format string followed by its arguments, which are only formatted if the
+            entry is going to be printed or saved
         """
-        self.__log("warn", " ".join(map(str, items)))
+        self.__log(2, items)
 
     def error(self, *items):
         """
         Logs at error level
 
         Args:
-          *items: logging info which will be converted to strings and saved
+          *items: logging info which will be converted to strings and saved. Can also be
+            a format string followed by its arguments, which are only formatted if the
+            entry is going to be printed or saved
         """
-        self.__log("error", " ".join(map(str, items)))
+        self.__log(3, items)
 
     def exception(self, *items):
         """
         Logs at exception level
 
         Args:
-          *items: logging info which will be converted to strings and saved
+          *items: logging info which will be converted to strings and saved. Can also be
+            a format string followed by its arguments, which are only formatted if the
+            entry is going to be printed or saved
         """
-        self.__log("exception", " ".join(map(str, items)))
+        self.__log(4, items)
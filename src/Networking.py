@@ -1,29 +1,43 @@
-from os import ilistdir, listdir, remove
-from time import gmtime, sleep_ms, ticks_ms
+from time import gmtime, sleep_ms, ticks_diff, ticks_ms
 from rp2 import country
 from network import STA_IF, WLAN, hostname
-from math import ceil
 from ubinascii import hexlify
 from ntptime import time
 from machine import RTC
-from urequests import post
-from ujson import load
+from ujson import dumps
+from ucollections import OrderedDict
 from utils.constants import (
     CYW43_LINK_DOWN,
     CYW43_LINK_JOIN,
     CYW43_LINK_UP,
     CYW43_STATUS_NAMES,
+    ENERGY_TIER_NAMES,
+    WIFI_FAST_TIMEOUT_MS,
+    WIFI_POLL_MAX_MS,
+    WIFI_POLL_MIN_MS,
 )
 from utils.config import (
+    LOG_ATTACH_LEVEL,
+    NICKNAME,
+    UPLOAD_BATCH_MAX_BYTES,
+    UPLOAD_BATCH_SIZE,
+    UPLOAD_CHUNKED,
+    UPLOAD_COMPRESSION,
     UPLOAD_DESTINATION,
+    UPLOAD_SESSION_MAX_BYTES,
+    UPLOAD_SESSION_MAX_SECONDS,
     WIFI_COUNTRY,
+    WIFI_FAST_RECONNECT,
     WIFI_HOSTNAME,
+    WIFI_LEASE_REUSE_HOURS,
     WIFI_PASSWORD,
     WIFI_SSID,
+    WIFI_STATIC_IP,
 )
-from utils.cached_reading_count import cached_reading_count
-from utils.file_exists import file_exists
+from utils.clock import iso, now, sync
 from utils.uid import uid
+from utils.json_stream import write_object
+from HTTPClient import HTTPClient
 
 
 class Networking:
@@ -33,23 +47,28 @@ class Networking:
     Args:
       logger (Logging): Logging controller for logging info to file
       is_usb_powered (int): Whether board is USB powered or not. Value from VBUS pin reading
+      queue (ReadingQueue): Queue of readings waiting to be uploaded
+      state (State): Persistent state, used to keep track of syncs and uploads
+      breaker (CircuitBreaker): Circuit breaker to record upload results with
+      profiler (Profiler): Profiler to time connecting, uploading and NTP syncs with
     """
 
-    def __init__(self, logger, is_usb_powered):
+    def __init__(self, logger, is_usb_powered, queue, state, breaker, profiler):
         self.__logger = logger
         self.__is_usb_powered = is_usb_powered
+        self.__queue = queue
+        self.__state = state
+        self.__breaker = breaker
+        self.__profiler = profiler
         # Don't initialise wlan until it's necessary
         self.__wlan = None
+        # when the current network session started, for limiting uploads by time
+        self.__session_start_ms = None
 
-    def connect(self):
+    def __prepare(self):
         """
-        Connect to wifi network
-
-        Raises:
-          Exception: On wifi network failure
+        Initialise the WLAN interface ready to connect
         """
-        start_ms = ticks_ms()
-
         # Set country for wifi connection
         country(WIFI_COUNTRY)
 
@@ -75,17 +94,184 @@ class Networking:
 
         self.__logger.info("- Ready to connect!")
 
-        # Start connection process
-        self.__logger.info(f"Connecting to wifi network: {WIFI_SSID}...")
-        mac = hexlify(self.__wlan.config("mac"), ":").decode()
-        self.__logger.info(f"- Device MAC addr: {mac}")
+    def __ip_to_bytes(self, ip):
+        """
+        Pack an IP address string into bytes for saving in persistent state
+
+        Args:
+          ip (str): IP address e.g. 192.168.0.10
+
+        Returns:
+          bytes: 4 byte packed IP address
+        """
+        return bytes(int(part) for part in ip.split("."))
+
+    def __bytes_to_ip(self, packed):
+        """
+        Unpack an IP address saved in persistent state into a string
+
+        Args:
+          packed (bytes): 4 byte packed IP address
+
+        Returns:
+          str: IP address e.g. 192.168.0.10
+        """
+        return ".".join(str(part) for part in packed)
+
+    def __cached_lease(self):
+        """
+        Get the DHCP lease from the last successful connection, if it's recent enough
+        to reuse
+
+        Returns:
+          tuple: (ip, netmask, gateway, dns) as passed to WLAN.ifconfig
+          None: If there's no lease recent enough to reuse
+        """
+        lease_age = now() - self.__state["wifi_lease_time"]
+        if not self.__state["wifi_lease_time"] or not (
+            0 <= lease_age < WIFI_LEASE_REUSE_HOURS * 60 * 60
+        ):
+            return None
+        return tuple(
+            self.__bytes_to_ip(self.__state[field])
+            for field in ("wifi_ip", "wifi_netmask", "wifi_gateway", "wifi_dns")
+        )
+
+    def __save_connection(self, bssid, channel):
+        """
+        Save details of the current connection to persistent state so the next
+        connection can skip straight to joining the same access point
+
+        Args:
+          bssid (bytes): BSSID of the access point connected to
+          channel (int): Channel of the access point connected to
+        """
+        self.__state["wifi_bssid"] = bssid
+        self.__state["wifi_channel"] = channel
+        ip, netmask, gateway, dns = self.__wlan.ifconfig()
+        self.__state["wifi_ip"] = self.__ip_to_bytes(ip)
+        self.__state["wifi_netmask"] = self.__ip_to_bytes(netmask)
+        self.__state["wifi_gateway"] = self.__ip_to_bytes(gateway)
+        self.__state["wifi_dns"] = self.__ip_to_bytes(dns)
+        self.__state["wifi_lease_time"] = now()
+
+    def __clear_connection(self):
+        """
+        Clear saved connection details, e.g. if they no longer work
+        """
+        self.__state["wifi_bssid"] = bytes(6)
+        self.__state["wifi_channel"] = 0
+        self.__state["wifi_lease_time"] = 0
+
+    def __fast_connect(self):
+        """
+        Try joining the access point from the last successful connection directly,
+        skipping the scan, and reusing its DHCP lease if recent enough
+
+        Returns:
+          bool: True if connected, False if not
+        """
+        bssid = self.__state["wifi_bssid"]
+        channel = self.__state["wifi_channel"]
+        if not WIFI_FAST_RECONNECT or bssid == bytes(6):
+            return False
+
+        self.__logger.info("- Trying fast reconnect on channel {}", channel)
+        lease = None
+        if WIFI_STATIC_IP is None:
+            lease = self.__cached_lease()
+            if lease is not None:
+                self.__wlan.ifconfig(lease)
 
-        self.__wlan.connect(WIFI_SSID, WIFI_PASSWORD)
         try:
-            self.__await_status(CYW43_LINK_UP)
+            self.__wlan.connect(WIFI_SSID, WIFI_PASSWORD, bssid=bssid, channel=channel)
+            if self.__await_status(CYW43_LINK_UP, timeout=WIFI_FAST_TIMEOUT_MS):
+                # Save the fresh lease if DHCP was used, so it can be reused again
+                if WIFI_STATIC_IP is None and lease is None:
+                    self.__save_connection(bssid, channel)
+                return True
         except Exception as x:
-            raise Exception(f"Failed to connect to network {WIFI_SSID}: {x}")
-        self.__logger.info("- Connected successfully!")
+            self.__logger.warn("- Fast reconnect failed: {}", x)
+
+        self.__logger.warn("- Fast reconnect failed, falling back to full connect")
+        self.__clear_connection()
+        self.__wlan.disconnect()
+        self.__await_status(CYW43_LINK_DOWN)
+        # Go back to DHCP if the old lease was being reused
+        if lease is not None:
+            self.__wlan.ifconfig("dhcp")
+        return False
+
+    def __full_connect(self):
+        """
+        Scan for the strongest access point for the network and join it
+
+        Returns:
+          bytes, int: BSSID and channel of the access point joined, None if not known
+
+        Raises:
+          Exception: On wifi network failure
+        """
+        bssid = None
+        channel = None
+        if WIFI_FAST_RECONNECT:
+            # Scan so the access point details can be saved for fast reconnects
+            networks = [n for n in self.__wlan.scan() if n[0].decode() == WIFI_SSID]
+            if networks:
+                best = max(networks, key=lambda n: n[3])
+                bssid = best[1]
+                channel = best[2]
+
+        if bssid is None:
+            self.__wlan.connect(WIFI_SSID, WIFI_PASSWORD)
+        else:
+            self.__wlan.connect(WIFI_SSID, WIFI_PASSWORD, bssid=bssid)
+
+        if not self.__await_status(CYW43_LINK_UP):
+            raise Exception("Timed out")
+        return bssid, channel
+
+    def connect(self):
+        """
+        Connect to wifi network.
+
+        First tries joining the access point from the last successful connection
+        directly, then falls back to a full scan and join
+
+        Raises:
+          Exception: On wifi network failure
+        """
+        start_ms = ticks_ms()
+        self.__prepare()
+        prepared_ms = ticks_ms()
+
+        # Start connection process
+        self.__logger.info("Connecting to wifi network: {}...", WIFI_SSID)
+        mac = hexlify(self.__wlan.config("mac"), ":").decode()
+        self.__logger.info("- Device MAC addr: {}", mac)
+
+        if WIFI_STATIC_IP is not None:
+            self.__wlan.ifconfig(WIFI_STATIC_IP)
+
+        if self.__fast_connect():
+            method = "fast"
+        else:
+            method = "full"
+            try:
+                bssid, channel = self.__full_connect()
+            except Exception as x:
+                raise Exception(f"Failed to connect to network {WIFI_SSID}: {x}")
+            if bssid is not None:
+                self.__save_connection(bssid, channel)
+
+        end_ms = ticks_ms()
+        self.__logger.info(
+            "- Connected successfully! ({} connect in {}ms: prepare {}ms, join {}ms)",
+            method,
+            ticks_diff(end_ms, start_ms),
+            ticks_diff(prepared_ms, start_ms),
+            ticks_diff(end_ms, prepared_ms),
+        )
 
     def __get_status(self):
         """
@@ -99,19 +285,24 @@ class Networking:
             return CYW43_LINK_DOWN
 
         status = self.__wlan.status()
-        self.__logger.info(
-            f"- active: {1 if self.__wlan.active() else 0}, status: {status} ({CYW43_STATUS_NAMES[status]})"
+        self.__logger.debug(
+            "- active: {}, status: {} ({})",
+            1 if self.__wlan.active() else 0,
+            status,
+            CYW43_STATUS_NAMES[status],
         )
         return status
 
-    def __await_status(self, expected_status, timeout=10000, sleep_dur=500):
+    def __await_status(self, expected_status, timeout=10000):
         """
-        Await a specific wifi connection status with timeout
+        Await a specific wifi connection status with timeout.
+
+        Polls quickly at first, backing off up to WIFI_POLL_MAX_MS between checks, so
+        quick status changes are picked up straight away
 
         Args:
           expected_status (int): Wifi status to wait for (defined in utils.constants)
           timeout (int): Amount of time to wait for status before declaring failure in ms
-          sleep_dur (int): Amount of time to sleep between each status check in ms
 
         Returns:
           bool: True if expected status returned, False if timeout hit without expected status
@@ -119,13 +310,16 @@ class Networking:
         Raises:
           Exception: If error status received
         """
-        for i in range(ceil(timeout / sleep_dur)):
-            sleep_ms(sleep_dur)
+        start = ticks_ms()
+        sleep_dur = WIFI_POLL_MIN_MS
+        while ticks_diff(ticks_ms(), start) < timeout:
             status = self.__get_status()
             if status == expected_status:
                 return True
             elif status < 0:
                 raise Exception(CYW43_STATUS_NAMES[status])
+            sleep_ms(sleep_dur)
+            sleep_dur = min(sleep_dur * 2, WIFI_POLL_MAX_MS)
         return False
 
     def disconnect(self):
@@ -135,7 +329,7 @@ class Networking:
         Raises:
           Exception: On disconnection failure
         """
-        self.__logger.info(f"Disconnecting from wifi network: {WIFI_SSID}...")
+        self.__logger.info("Disconnecting from wifi network: {}...", WIFI_SSID)
 
         if self.__wlan is None:
             self.__logger.warn("- WLAN not initialised, so assuming disconnected")
@@ -148,9 +342,60 @@ class Networking:
             raise Exception(f"Failed to disconnect: {x}")
         self.__logger.info("- Successfully disconnected")
 
+    def run_session(self, tasks, uploading=False):
+        """
+        Run network tasks one after another within a single wifi connection, so the
+        cost of joining the network is only paid once per wake.
+
+        The radio is powered down again afterwards. As uploads can't happen without
+        wifi, failing to connect counts as a failed upload session if the session
+        was going to upload
+
+        Args:
+          tasks (list): Functions to run while connected, in order
+          uploading (bool): True if one of the tasks uploads readings
+
+        Returns:
+          list: What each task returned
+
+        Raises:
+          Exception: On wifi network failure
+        """
+        self.__logger.info("Starting network session with {} task(s)", len(tasks))
+        self.__session_start_ms = ticks_ms()
+        try:
+            with self.__profiler.phase("connect"):
+                self.connect()
+        except Exception:
+            if uploading:
+                self.__breaker.record_failure()
+            self.power_down()
+            raise
+
+        try:
+            return [task() for task in tasks]
+        finally:
+            with self.__profiler.phase("disconnect"):
+                try:
+                    self.disconnect()
+                except Exception as x:
+                    self.__logger.warn("- {}", x)
+                self.power_down()
+
+    def power_down(self):
+        """
+        Power down the wifi radio, freeing up the pins it shares with the VSYS
+        voltage reading
+        """
+        if self.__wlan is not None:
+            self.__wlan.active(False)
+            self.__wlan.deinit()
+            self.__wlan = None
+
     def sync_rtc_from_ntp(self, i2c, rtc):
         """
-        Connect to wifi and sync RTC chip to time from an NTP server
+        Sync RTC chip to time from an NTP server. Must be run within a network
+        session
 
         Args:
             i2c (PimoroniI2C): I2C to enable setting RTC chip time
@@ -161,15 +406,17 @@ class Networking:
 
         """
         self.__logger.info("Syncing RTC to NTP server")
-        self.connect()
 
         # Fetch current timestamp from NTP server and convert to usable tuple
-        timestamp = time()
-        if not timestamp:
+        try:
+            with self.__profiler.phase("ntp"):
+                epoch = time()
+        except OSError:
+            epoch = None
+        if not epoch:
             self.__logger.error("- Failed to fetch time from NTP server")
-            return
-        timestamp = gmtime(timestamp)
-        self.disconnect()
+            return False
+        timestamp = gmtime(epoch)
 
         # Set RTC chip to new time
         i2c.writeto_mem(0x51, 0x00, b"\x10")  # Reset RTC to change time
@@ -180,61 +427,286 @@ class Networking:
         # Check the new RTC time to make sure it updated successfully
         dt = rtc.datetime()
         if dt != timestamp[0:7]:
-            # Remove last_rtc_sync.txt to trigger reattempt next time
-            if file_exists("last_rtc_sync.txt"):
-                remove("last_rtc_sync.txt")
+            self.__logger.error("- RTC time didn't update")
+            # Clear last sync time to trigger reattempt next time
+            self.__state["last_rtc_sync"] = 0
             return False
 
         # Sync pico RTC too
         RTC().datetime((dt[0], dt[1], dt[2], dt[6], dt[3], dt[4], dt[5], 0))
+        sync()
 
         self.__logger.info("- RTC synced successfully")
 
-        # Write latest sync time to file
-        with open("last_rtc_sync.txt", "w") as syncfile:
-            syncfile.write(
-                "{0:04d}-{1:02d}-{2:02d}T{3:02d}:{4:02d}:{5:02d}Z".format(*timestamp)
-            )
+        # Save latest sync time
+        self.__state["last_rtc_sync"] = epoch
 
         return True
 
-    def upload_readings(self):
+    def __payload(self, reading):
+        """
+        Build the upload payload for a queued reading
+
+        Args:
+          reading (dict): Reading taken from the reading queue
+
+        Returns:
+          dict (OrderedDict): Payload ready to be serialised
+        """
+        timestamp = reading.pop("timestamp")
+        voltage = reading.pop("voltage")
+        energy_tier = reading.pop("energy_tier")
+        payload = OrderedDict(
+            [
+                ("nickname", NICKNAME),
+                ("timestamp", iso(timestamp)),
+                ("readings", reading),
+                ("model", "weather"),
+                ("uid", uid()),
+                ("voltage", voltage),
+                ("energy_tier", ENERGY_TIER_NAMES[energy_tier]),
+            ]
+        )
+        return payload
+
+    def __diagnostics(self):
+        """
+        Build diagnostics about the station to attach to the first reading uploaded
+        in a session
+
+        Returns:
+          dict (OrderedDict): Diagnostics
+        """
+        return OrderedDict(
+            [
+                ("backlog", self.__queue.count()),
+                ("upload_failures", self.__state["upload_failures"]),
+                ("wake_count", self.__state["wake_count"]),
+                ("readings_queued", self.__state["readings_queued"]),
+                ("readings_uploaded", self.__state["readings_uploaded"]),
+                ("profile", self.__profiler.summary()),
+            ]
+        )
+
+    def __next_batch(self, logs, limit):
+        """
+        Get the next batch of queued readings, limited by UPLOAD_BATCH_SIZE and
+        UPLOAD_BATCH_MAX_BYTES
+
+        Args:
+          logs (tuple): Start and end position of log entries to attach to the first
+          reading in the batch, along with diagnostics, if any
+          limit (int): Maximum number of readings in the batch
+
+        Returns:
+          list: Payloads of the readings in the batch, oldest first
+        """
+        payloads = []
+        # Count the attached log entries by their size in the log files, which is
+        # close enough without reading through them
+        batch_bytes = logs[1] - logs[0] if logs is not None else 0
+
+        for reading in self.__queue.peek(limit):
+            payload = self.__payload(reading)
+            if not payloads and logs is not None:
+                payload["diagnostics"] = self.__diagnostics()
+            # Account for the comma separating readings in the array too
+            size = len(dumps(payload)) + 1
+            # Skip the size check for the first reading so one oversized
+            # reading can't block the rest of the queue
+            if payloads and batch_bytes + size > UPLOAD_BATCH_MAX_BYTES:
+                break
+            payloads.append(payload)
+            batch_bytes += size
+
+        return payloads
+
+    def __batch_writer(self, payloads, logs):
         """
-        Upload cached readings to http endpoint
+        Get a function that writes a batch of payloads as a request body, one reading
+        at a time and streaming any attached log entries from the log files, so the
+        whole body is never held in memory at once
+
+        Args:
+          payloads (list): Payloads of the readings in the batch
+          logs (tuple): Start and end position of log entries to attach to the first
+          reading in the batch, if any
+
+        Returns:
+          function: Writes the body using the function passed to it
         """
-        self.__logger.info("Preparing to upload readings...")
-        self.connect()
 
+        def write_logs(write):
+            self.__logger.write_entries(write, logs[0], logs[1], LOG_ATTACH_LEVEL)
+
+        def write_batch(write):
+            # Send a single reading as-is, otherwise send the batch as a JSON array
+            if UPLOAD_BATCH_SIZE > 1:
+                write("[")
+            for i, payload in enumerate(payloads):
+                if i:
+                    write(",")
+                if i == 0 and logs is not None:
+                    write_object(write, payload, {"logs": write_logs})
+                else:
+                    write_object(write, payload)
+            if UPLOAD_BATCH_SIZE > 1:
+                write("]")
+
+        return write_batch
+
+    def __acknowledged(self, res, batch_size):
+        """
+        Work out which readings in an uploaded batch the server accepted.
+
+        A successful response acknowledges the whole batch, unless its body is a JSON
+        object with an "accepted" list of batch indexes, in which case only those are
+        acknowledged
+
+        Args:
+          res (Response): Response returned by the upload request
+          batch_size (int): Number of readings sent in the request
+
+        Returns:
+          list: Indexes of acknowledged readings within the batch
+        """
+        if res.status_code not in [200, 201, 202]:
+            return []
+
+        try:
+            accepted = res.json().get("accepted")
+        except (ValueError, AttributeError):
+            accepted = None
+
+        if not isinstance(accepted, list):
+            return list(range(batch_size))
+
+        return [i for i in accepted if isinstance(i, int) and 0 <= i < batch_size]
+
+    def upload_readings(self):
+        """
+        Upload queued readings to http endpoint. Must be run within a network
+        session.
+
+        Readings are sent oldest first in batches of up to UPLOAD_BATCH_SIZE per
+        request, and only readings acknowledged by the server are removed from the
+        queue. Any new log entries are attached to the first reading sent, along with
+        diagnostics including the size of the backlog.
+
+        Each session stops once it has taken UPLOAD_SESSION_MAX_SECONDS or sent
+        UPLOAD_SESSION_MAX_BYTES, leaving the rest of the backlog for the next session.
+
+        The result is recorded with the upload circuit breaker, unless no requests
+        were made. If the breaker is half open the first request is a probe of a
+        single reading, and the session only carries on if it succeeds
+
+        Returns:
+          bool: True if the new log entries were shipped, or there weren't any
+        """
         self.__logger.info(
-            f"Uploading {cached_reading_count()} cached reading(s) to {UPLOAD_DESTINATION}..."
+            "Uploading {} queued reading(s) to {}...",
+            self.__queue.count(),
+            UPLOAD_DESTINATION,
         )
 
-        # Upload each cached reading in turn
-        for reading_file in ilistdir("uploads"):
+        # Only entries logged before now are attached, so logging while uploading
+        # doesn't change what's being sent
+        logs = self.__logger.unshipped()
+        # Keep one connection open for the whole session
+        client = HTTPClient(UPLOAD_DESTINATION, self.__profiler)
+        if UPLOAD_COMPRESSION and not client.can_compress():
+            self.__logger.warn("- Compression not supported, uploading uncompressed")
+        start_ms = ticks_ms()
+        failed = False
+
+        while self.__queue.count():
+            # Leave the rest for next time if the session has used up its budget
+            elapsed_ms = ticks_diff(ticks_ms(), self.__session_start_ms)
+            if (
+                elapsed_ms >= UPLOAD_SESSION_MAX_SECONDS * 1000
+                or client.sent_bytes >= UPLOAD_SESSION_MAX_BYTES
+            ):
+                self.__logger.info(
+                    "- Session budget used up after {}ms and {} bytes",
+                    elapsed_ms,
+                    client.sent_bytes,
+                )
+                break
+
+            # A probe only needs to show the endpoint is back, so keep it small
+            limit = 1 if self.__breaker.is_probing() else UPLOAD_BATCH_SIZE
+            payloads = self.__next_batch(logs, limit)
+            batch_size = len(payloads)
+
             try:
-                with open(f"uploads/{reading_file[0]}", "r") as upload_file:
-                    try:
-                        res = post(
-                            UPLOAD_DESTINATION, auth=None, json=(load(upload_file))
-                        )
-                        res.close()
-
-                        # If upload successful, delete cached upload
-                        if res.status_code in [200, 201, 202]:
-                            remove(f"uploads/{reading_file[0]}")
-                            self.__logger.info(f"- Uploaded {reading_file[0]}")
-                        else:
-                            self.__logger.error(
-                                f"- Upload of {reading_file[0]} failed. Status: {res.status_code}, Reason: {res.reason}"
-                            )
-
-                    except Exception as x:
-                        self.__logger.exception(
-                            f"- An exception occurred when uploading: {x}"
-                        )
-
-            except OSError:
-                self.__logger.error(f"- Failed to open '{reading_file[0]}'")
-
-        # Finally, disconnect from wifi
-        self.disconnect()
+                with self.__profiler.phase("post"):
+                    res = client.post(
+                        self.__batch_writer(payloads, logs),
+                        headers={"Content-Type": "application/json"},
+                        compress=UPLOAD_COMPRESSION,
+                        chunked=UPLOAD_CHUNKED,
+                    )
+                acknowledged = self.__acknowledged(res, batch_size)
+                res.close()
+            except Exception as x:
+                self.__logger.exception("- An exception occurred when uploading: {}", x)
+                failed = True
+                break
+
+            if not acknowledged:
+                self.__logger.error(
+                    "- Upload of {} reading(s) failed. Status: {}, Reason: {}",
+                    batch_size,
+                    res.status_code,
+                    res.reason,
+                )
+                failed = True
+                break
+
+            # Logs are attached to the first reading, so once that's acknowledged
+            # they don't need sending again
+            if logs is not None and 0 in acknowledged:
+                self.__logger.mark_shipped(logs[1])
+                logs = None
+
+            # Readings can only be removed from the front of the queue, so anything
+            # acknowledged after an unacknowledged reading gets sent again next time
+            uploaded = 0
+            while uploaded in acknowledged:
+                uploaded += 1
+            self.__queue.discard(uploaded)
+            self.__state["readings_uploaded"] += uploaded
+            self.__logger.info("- Uploaded {} of {} reading(s)", uploaded, batch_size)
+            if uploaded:
+                self.__breaker.record_success()
+
+            if uploaded < batch_size:
+                failed = True
+                break
+
+        client.close()
+        self.__logger.info(
+            "- Made {} request(s) over {} connection(s) in {}ms",
+            client.requests,
+            client.connections,
+            ticks_diff(ticks_ms(), start_ms),
+        )
+        if UPLOAD_COMPRESSION and client.can_compress() and client.body_bytes:
+            self.__logger.info(
+                "- Compressed {} bytes to {} ({}%) in {}ms",
+                client.body_bytes,
+                client.sent_bytes,
+                round(100 * client.sent_bytes / client.body_bytes),
+                client.compress_ms,
+            )
+
+        self.__logger.info("- {} reading(s) left in backlog", self.__queue.count())
+
+        # Stopping because of the session budget doesn't count as a failure, and a
+        # session that made no requests says nothing about the endpoint
+        if failed:
+            self.__breaker.record_failure()
+        elif client.requests:
+            self.__breaker.record_success()
+
+        return logs is None or logs[0] == logs[1]
@@ -0,0 +1,216 @@
+from gc import collect, mem_alloc, mem_free
+from time import ticks_diff, ticks_us
+from ucollections import OrderedDict
+from utils.config import MEMORY_PROFILE_STRICT
+from utils.constants import (
+    PROFILE_BUCKET_COUNT,
+    PROFILE_BUCKET_FACTOR,
+    PROFILE_MEMORY_PHASES,
+    PROFILE_PHASES,
+    PROFILE_WINDOW,
+)
+
+
+class Phase:
+    """
+    Context manager which times a block of code as a profiler phase, and records
+    the lowest free and highest allocated heap seen at either end of it and at every
+    `Profiler.sample` call in between.
+
+    MicroPython doesn't count garbage collections, so one is assumed to have
+    happened whenever less memory is allocated than at the last sample. With
+    MEMORY_PROFILE_STRICT, a collection is run before the phase starts
+
+    Args:
+        profiler (Profiler): Profiler to record the time with
+        name (str): Name of the phase, one of PROFILE_PHASES
+        active (list): Phases currently running, which this adds itself to while
+        it runs so it's sampled
+    """
+
+    def __init__(self, profiler, name, active):
+        self.__profiler = profiler
+        self.__name = name
+        self.__active = active
+        self.__start = None
+        self.__low_free = None
+        self.__high_alloc = None
+        self.__last_alloc = None
+        self.__collections = 0
+
+    def __enter__(self):
+        if MEMORY_PROFILE_STRICT:
+            collect()
+        self.__low_free = mem_free()
+        self.__high_alloc = self.__last_alloc = mem_alloc()
+        self.__collections = 0
+        self.__active.append(self)
+        self.__start = ticks_us()
+        return self
+
+    def sample(self, free, alloc):
+        """
+        Update the heap usage of the phase
+
+        Args:
+            free (int): Free heap in bytes
+            alloc (int): Allocated heap in bytes
+        """
+        self.__low_free = min(self.__low_free, free)
+        self.__high_alloc = max(self.__high_alloc, alloc)
+        if alloc < self.__last_alloc:
+            self.__collections += 1
+        self.__last_alloc = alloc
+
+    def __exit__(self, *args):
+        duration_us = ticks_diff(ticks_us(), self.__start)
+        self.__active.remove(self)
+        self.sample(mem_free(), mem_alloc())
+        memory = (self.__low_free, self.__high_alloc, self.__collections)
+        self.__profiler.record(self.__name, duration_us, memory)
+
+
+class Profiler:
+    """
+    Records how long each phase of a wake takes, e.g. `with profiler.phase("post"):`.
+
+    For each phase, the min, mean and max duration and a histogram of durations are
+    kept in persistent state. Min, max and histogram cover roughly the last
+    PROFILE_WINDOW times the phase ran, with the histogram counts halved each time a
+    new window starts so old samples fade out. Histogram buckets are each
+    PROFILE_BUCKET_FACTOR times wider than the last, starting below 1ms.
+
+    Phases timed with `phase` also keep the lowest free and highest allocated heap
+    seen during the phase, and how many garbage collections happened during it, over
+    the same window. Long running code can call `sample` to catch peaks in the middle
+    of a phase
+
+    Args:
+        state (State): Persistent state, used to keep durations between wakes
+    """
+
+    def __init__(self, state):
+        self.__state = state
+        # total duration of each phase this wake
+        self.__wake = {}
+        # phases currently running, innermost last
+        self.__active = []
+        # ticks count up from reset, so this is how long it took to get here
+        self.record("boot", ticks_us())
+
+    def phase(self, name):
+        """
+        Time a phase of the wake
+
+        Args:
+            name (str): Name of the phase, one of PROFILE_PHASES
+
+        Returns:
+            Phase: Context manager to time the phase with
+        """
+        return Phase(self, name, self.__active)
+
+    def sample(self):
+        """
+        Sample heap usage for the phases currently running. Reading the heap usage
+        walks the heap, so should only be called every so often, not in tight loops
+        """
+        if not self.__active:
+            return
+        free = mem_free()
+        alloc = mem_alloc()
+        for phase in self.__active:
+            phase.sample(free, alloc)
+
+    def __bucket(self, duration_us):
+        """
+        Get the histogram bucket a duration falls into
+
+        Args:
+            duration_us (int): Duration in µs
+
+        Returns:
+            int: Index of the histogram bucket
+        """
+        duration_ms = duration_us // 1000
+        bucket = 0
+        bound = 1
+        while bucket < PROFILE_BUCKET_COUNT - 1 and duration_ms >= bound:
+            bucket += 1
+            bound *= PROFILE_BUCKET_FACTOR
+        return bucket
+
+    def record(self, name, duration_us, memory=None):
+        """
+        Record the duration of a phase
+
+        Args:
+            name (str): Name of the phase, one of PROFILE_PHASES
+            duration_us (int): Duration in µs
+            memory (tuple): Free and allocated heap in bytes and garbage collections
+            during the phase, only for PROFILE_MEMORY_PHASES
+        """
+        field = "profile_" + name
+        minimum, mean, maximum, samples, *histogram = self.__state[field]
+
+        # Start a new window, fading out the old samples
+        if samples >= PROFILE_WINDOW:
+            samples = 0
+            histogram = [count // 2 for count in histogram]
+
+        if samples == 0:
+            minimum = duration_us
+            maximum = duration_us
+        else:
+            minimum = min(minimum, duration_us)
+            maximum = max(maximum, duration_us)
+        # Running average weighting each new sample 1/8
+        mean = duration_us if not mean else mean + (duration_us - mean) // 8
+
+        bucket = self.__bucket(duration_us)
+        histogram[bucket] = min(histogram[bucket] + 1, 0xFFFF)
+
+        self.__state[field] = [minimum, mean, maximum, samples + 1] + histogram
+        self.__wake[name] = self.__wake.get(name, 0) + duration_us
+
+        if memory is not None:
+            free, alloc, collections = memory
+            if samples:
+                low_free, high_alloc, total = self.__state["memory_" + name]
+                free = min(free, low_free)
+                alloc = max(alloc, high_alloc)
+                collections += total
+            self.__state["memory_" + name] = [free, alloc, collections]
+
+    def summary(self):
+        """
+        Summarise phase durations for uploading, all in ms, and heap usage in bytes
+
+        Returns:
+            dict (OrderedDict): For each phase that has run: the total this wake (None
+            if it hasn't run this wake), min, mean, max and histogram counts. Phases
+            with heap usage recorded also have the lowest free and highest allocated
+            heap, and the number of garbage collections
+        """
+        summary = OrderedDict()
+        for name in PROFILE_PHASES:
+            stats = self.__state["profile_" + name]
+            minimum, mean, maximum, samples, *histogram = stats
+            if not samples:
+                continue
+            wake = self.__wake.get(name)
+            summary[name] = OrderedDict(
+                [
+                    ("wake", None if wake is None else wake // 1000),
+                    ("min", minimum // 1000),
+                    ("mean", mean // 1000),
+                    ("max", maximum // 1000),
+                    ("histogram", histogram),
+                ]
+            )
+            if name in PROFILE_MEMORY_PHASES:
+                free, alloc, collections = self.__state["memory_" + name]
+                summary[name]["free_min"] = free
+                summary[name]["alloc_max"] = alloc
+                summary[name]["collections"] = collections
+        return summary
@@ -0,0 +1,136 @@
+from struct import calcsize, pack_into, unpack_from
+from utils.constants import RAIN_BUFFER_CAPACITY
+from utils.file_exists import file_exists
+
+# Header holds the total number of tips ever recorded, which doubles as the head index
+HEADER_FORMAT = "<I"
+HEADER_SIZE = calcsize(HEADER_FORMAT)
+ENTRY_FORMAT = "<I"
+ENTRY_SIZE = calcsize(ENTRY_FORMAT)
+# Trailer after the entries holds the number of rain wakes and how long the last one
+# took in ms. Files written before it was added just end without one
+TRAILER_FORMAT = "<IH"
+TRAILER_SIZE = calcsize(TRAILER_FORMAT)
+
+
+class RainBuffer:
+    """
+    Preallocated ring buffer file of rain bucket tip timestamps.
+
+    Recording a tip overwrites a single entry in place and updates the head index,
+    so it takes the same time and flash wear no matter how many tips are stored
+    """
+
+    def __init__(self):
+        self.__rain_file = "rain.bin"
+        self.__capacity = RAIN_BUFFER_CAPACITY
+        # Reusable buffers so recording a tip doesn't need to allocate
+        self.__buf = bytearray(ENTRY_SIZE)
+        self.__trailer = bytearray(TRAILER_SIZE)
+
+    def __create(self):
+        """
+        Create the rain buffer file with space preallocated for every entry
+        """
+        with open(self.__rain_file, "wb") as rainfile:
+            pack_into(HEADER_FORMAT, self.__buf, 0, 0)
+            rainfile.write(self.__buf)
+            pack_into(ENTRY_FORMAT, self.__buf, 0, 0)
+            for _ in range(self.__capacity):
+                rainfile.write(self.__buf)
+            pack_into(TRAILER_FORMAT, self.__trailer, 0, 0, 0)
+            rainfile.write(self.__trailer)
+
+    def record(self, timestamp, wake_ms=None):
+        """
+        Record a rain bucket tip
+
+        Args:
+          timestamp (int): Unix style timestamp of the tip
+          wake_ms (int): If recorded by a rain wake, how long the wake has taken so
+            far. Counted in the trailer, written in place along with the tip
+        """
+        if not file_exists(self.__rain_file):
+            self.__create()
+
+        with open(self.__rain_file, "r+b") as rainfile:
+            rainfile.readinto(self.__buf)
+            head = unpack_from(HEADER_FORMAT, self.__buf)[0]
+
+            # Overwrite the oldest entry with the new tip
+            pack_into(ENTRY_FORMAT, self.__buf, 0, timestamp)
+            rainfile.seek(HEADER_SIZE + (head % self.__capacity) * ENTRY_SIZE)
+            rainfile.write(self.__buf)
+
+            pack_into(HEADER_FORMAT, self.__buf, 0, head + 1)
+            rainfile.seek(0)
+            rainfile.write(self.__buf)
+
+            if wake_ms is not None:
+                rainfile.seek(HEADER_SIZE + self.__capacity * ENTRY_SIZE)
+                wakes = self.__read_trailer(rainfile)[0]
+                pack_into(
+                    TRAILER_FORMAT, self.__trailer, 0, wakes + 1, min(wake_ms, 0xFFFF)
+                )
+                rainfile.seek(HEADER_SIZE + self.__capacity * ENTRY_SIZE)
+                rainfile.write(self.__trailer)
+
+    def __read_trailer(self, rainfile):
+        """
+        Read the trailer at the current file position
+
+        Args:
+          rainfile (file): Rain buffer file, positioned at the trailer
+
+        Returns:
+          tuple: Number of rain wakes and how long the last took in ms, both 0 if the
+          file has no trailer yet
+        """
+        if rainfile.readinto(self.__trailer) != TRAILER_SIZE:
+            return 0, 0
+        return unpack_from(TRAILER_FORMAT, self.__trailer)
+
+    def wake_stats(self):
+        """
+        Get the number of rain wakes and how long the last one took
+
+        Returns:
+          tuple: Number of rain wakes and how long the last took in ms
+        """
+        if not file_exists(self.__rain_file):
+            return 0, 0
+
+        with open(self.__rain_file, "rb") as rainfile:
+            rainfile.seek(HEADER_SIZE + self.__capacity * ENTRY_SIZE)
+            return self.__read_trailer(rainfile)
+
+    def count_since(self, timestamp):
+        """
+        Count the rain bucket tips recorded after a given time
+
+        Args:
+          timestamp (int): Unix style timestamp to count tips after
+
+        Returns:
+          int: Number of tips recorded after `timestamp`
+        """
+        if not file_exists(self.__rain_file):
+            return 0
+
+        count = 0
+        chunk = bytearray(64 * ENTRY_SIZE)
+        with open(self.__rain_file, "rb") as rainfile:
+            rainfile.readinto(self.__buf)
+            remaining = min(unpack_from(HEADER_FORMAT, self.__buf)[0], self.__capacity)
+
+            while remaining > 0:
+                read = rainfile.readinto(chunk)
+                entries = min(read // ENTRY_SIZE, remaining)
+                if not entries:
+                    break
+                for i in range(entries):
+                    if unpack_from(ENTRY_FORMAT, chunk, i * ENTRY_SIZE)[0] > timestamp:
+                        count += 1
+                remaining -= entries
+
+        return count
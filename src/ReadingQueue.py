@@ -0,0 +1,310 @@
+from os import listdir, remove, rename, rmdir
+from struct import calcsize, pack, pack_into, unpack_from
+from time import mktime
+from ucollections import OrderedDict
+from ujson import load
+from utils.config import READING_QUEUE_CAPACITY
+from utils.file_exists import file_exists
+
+# Fields stored for each reading, in record order. New fields must only ever be
+# appended to the end so records written by older firmware can still be read
+READING_FIELDS = (
+    ("timestamp", "I"),
+    ("voltage", "f"),
+    ("temperature", "f"),
+    ("humidity", "f"),
+    ("pressure", "f"),
+    ("luminance", "f"),
+    ("wind_speed", "f"),
+    ("rain", "f"),
+    ("rain_per_second", "f"),
+    ("wind_direction", "H"),
+    ("wind_gust", "f"),
+    ("wind_lull", "f"),
+    ("wind_direction_variance", "f"),
+    ("energy_tier", "B"),
+)
+
+# Header layout: magic, record size, capacity, head index, tail index
+HEADER_FORMAT = "<4sHIII"
+HEADER_SIZE = calcsize(HEADER_FORMAT)
+HEADER_MAGIC = b"WVRQ"
+
+RECORD_FORMAT = "<" + "".join(fmt for _, fmt in READING_FIELDS)
+RECORD_SIZE = calcsize(RECORD_FORMAT)
+
+
+class ReadingQueue:
+    """
+    Fixed size record queue of readings waiting to be uploaded.
+
+    Readings are packed into fixed size records in a single file which is used as a
+    ring buffer, with head and tail indexes kept in a small header at the start of the
+    file. Once the queue is full, the oldest readings are overwritten.
+
+    The queue file is only loaded when the queue is first used, so no file access
+    happens while the board is being set up
+
+    Args:
+      logger (Logging): Logging controller for logging info to file
+    """
+
+    def __init__(self, logger):
+        self.__logger = logger
+        self.__queue_file = "readings.bin"
+        self.__capacity = READING_QUEUE_CAPACITY
+        self.__head = 0
+        self.__tail = 0
+        self.__header = bytearray(HEADER_SIZE)
+        self.__loaded = False
+
+    def __ensure_loaded(self):
+        """
+        Load the queue file, and import any legacy cached readings, if not done yet
+        """
+        if self.__loaded:
+            return
+        if file_exists(self.__queue_file):
+            self.__load()
+        self.__loaded = True
+        self.__import_legacy()
+
+    def __load(self):
+        """
+        Load the head and tail indexes from the queue file header, migrating the
+        queue file if it was written with a different record layout or capacity
+        """
+        try:
+            with open(self.__queue_file, "rb") as queuefile:
+                magic, record_size, capacity, head, tail = unpack_from(
+                    HEADER_FORMAT, queuefile.read(HEADER_SIZE)
+                )
+        except ValueError:
+            magic = None
+
+        if magic != HEADER_MAGIC:
+            self.__logger.error("Reading queue file is corrupt, discarding it")
+            remove(self.__queue_file)
+            return
+
+        if record_size != RECORD_SIZE or capacity != self.__capacity:
+            self.__migrate(record_size, capacity, head, tail)
+            return
+
+        self.__head = head
+        self.__tail = tail
+
+    def __import_legacy(self):
+        """
+        Move readings cached as JSON files in the uploads directory by older firmware
+        into the queue, so they're still uploaded, then remove the directory. Any
+        logs attached to them are dropped. Files which can't be read right now are
+        left to try again next time
+        """
+        try:
+            filenames = sorted(listdir("uploads"))
+        except OSError:
+            return
+
+        self.__logger.info("Importing {} legacy cached reading(s)", len(filenames))
+        for filename in filenames:
+            path = "uploads/" + filename
+            try:
+                with open(path, "r") as upload_file:
+                    payload = load(upload_file)
+                # Timestamps were saved as YYYY-mm-ddTHH:MM:SSZ
+                ts = payload["timestamp"]
+                reading = payload["readings"]
+                reading["timestamp"] = mktime(
+                    (
+                        int(ts[0:4]),
+                        int(ts[5:7]),
+                        int(ts[8:10]),
+                        int(ts[11:13]),
+                        int(ts[14:16]),
+                        int(ts[17:19]),
+                        0,
+                        0,
+                    )
+                )
+                reading["voltage"] = payload["voltage"]
+                self.append(reading)
+            except OSError as x:
+                self.__logger.warn("- Couldn't import cached reading {}: {}", path, x)
+                continue
+            except (KeyError, TypeError, ValueError):
+                self.__logger.warn("- Discarding unreadable cached reading {}", path)
+            try:
+                remove(path)
+            except OSError:
+                pass
+
+        # Fails if any files were left to try again
+        try:
+            rmdir("uploads")
+        except OSError:
+            pass
+
+    def __migrate(self, record_size, capacity, head, tail):
+        """
+        Rewrite the queue file using the current record layout and capacity
+
+        Args:
+          record_size (int): Size of records in the existing queue file
+          capacity (int): Capacity of the existing queue file
+          head (int): Head index of the existing queue file
+          tail (int): Tail index of the existing queue file
+        """
+        self.__logger.info(
+            "Migrating reading queue ({} readings) to new layout", tail - head
+        )
+        # Keep the newest readings if the new capacity is smaller
+        head = max(head, tail - self.__capacity)
+
+        with open(self.__queue_file, "rb") as in_file:
+            with open(self.__queue_file + ".tmp", "wb") as out_file:
+                self.__head = 0
+                self.__tail = tail - head
+                out_file.write(self.__pack_header())
+                for i in range(head, tail):
+                    in_file.seek(HEADER_SIZE + (i % capacity) * record_size)
+                    reading = self.__decode(in_file.read(record_size))
+                    out_file.write(self.__encode(reading))
+
+        remove(self.__queue_file)
+        rename(self.__queue_file + ".tmp", self.__queue_file)
+
+    def __pack_header(self):
+        """
+        Pack the current queue state into the header buffer
+
+        Returns:
+          bytearray: Packed header
+        """
+        pack_into(
+            HEADER_FORMAT,
+            self.__header,
+            0,
+            HEADER_MAGIC,
+            RECORD_SIZE,
+            self.__capacity,
+            self.__head,
+            self.__tail,
+        )
+        return self.__header
+
+    def __encode(self, reading):
+        """
+        Pack a reading into a record
+
+        Args:
+          reading (dict): Reading values keyed by field name
+
+        Returns:
+          bytes: Packed record
+        """
+        return pack(
+            RECORD_FORMAT, *[reading.get(name, 0) for name, _ in READING_FIELDS]
+        )
+
+    def __decode(self, record):
+        """
+        Unpack a record into a reading. Fields missing from records written with an
+        older layout are set to 0
+
+        Args:
+          record (bytes): Packed record
+
+        Returns:
+          dict (OrderedDict): Reading values keyed by field name
+        """
+        reading = OrderedDict()
+        offset = 0
+        for name, fmt in READING_FIELDS:
+            size = calcsize("<" + fmt)
+            if offset + size <= len(record):
+                reading[name] = unpack_from("<" + fmt, record, offset)[0]
+            else:
+                reading[name] = 0
+            offset += size
+        return reading
+
+    def count(self):
+        """
+        Get the number of readings waiting in the queue
+
+        Returns:
+          int: Number of queued readings
+        """
+        self.__ensure_loaded()
+        return self.__tail - self.__head
+
+    def append(self, reading):
+        """
+        Add a reading to the end of the queue, overwriting the oldest reading if full
+
+        Args:
+          reading (dict): Reading values keyed by field name
+        """
+        self.__ensure_loaded()
+        if self.count() >= self.__capacity:
+            self.__logger.warn("- Reading queue full, discarding oldest reading")
+            self.__head += 1
+
+        record = self.__encode(reading)
+        position = HEADER_SIZE + (self.__tail % self.__capacity) * RECORD_SIZE
+        self.__tail += 1
+
+        if not file_exists(self.__queue_file):
+            with open(self.__queue_file, "wb") as queuefile:
+                queuefile.write(self.__pack_header())
+                queuefile.write(record)
+            return
+
+        with open(self.__queue_file, "r+b") as queuefile:
+            queuefile.seek(position)
+            queuefile.write(record)
+            queuefile.seek(0)
+            queuefile.write(self.__pack_header())
+
+    def peek(self, count):
+        """
+        Get readings from the front of the queue without removing them
+
+        Args:
+          count (int): Maximum number of readings to get
+
+        Returns:
+          list: Readings, oldest first
+        """
+        self.__ensure_loaded()
+        readings = []
+        if not self.count():
+            return readings
+
+        with open(self.__queue_file, "rb") as queuefile:
+            for i in range(self.__head, min(self.__head + count, self.__tail)):
+                queuefile.seek(HEADER_SIZE + (i % self.__capacity) * RECORD_SIZE)
+                readings.append(self.__decode(queuefile.read(RECORD_SIZE)))
+        return readings
+
+    def discard(self, count):
+        """
+        Remove readings from the front of the queue, e.g. once they've been uploaded
+
+        Args:
+          count (int): Number of readings to remove
+        """
+        self.__ensure_loaded()
+        self.__head = min(self.__head + count, self.__tail)
+
+        # Once empty, remove the queue file completely to free up its flash blocks
+        if not self.count():
+            self.__head = 0
+            self.__tail = 0
+            if file_exists(self.__queue_file):
+                remove(self.__queue_file)
+            return
+
+        with open(self.__queue_file, "r+b") as queuefile:
+            queuefile.write(self.__pack_header())
@@ -0,0 +1,205 @@
+from utils.config import (
+    LOG_SHIP_FREQUENCY,
+    READING_FREQUENCY,
+    RTC_RESYNC_FREQUENCY,
+    SCHEDULE_COALESCE_MINUTES,
+    UPLOAD_FREQUENCY,
+)
+from utils.constants import (
+    SCHEDULE_SLACK_SECONDS,
+    TASK_LOG_SHIP,
+    TASK_NAMES,
+    TASK_READING,
+    TASK_RESYNC,
+    TASK_UPLOAD,
+)
+from utils.clock import iso, now
+
+# Persistent state field each task's next due time is kept in. The resync is due
+# a fixed time after the last successful sync, so works it out from that instead
+DUE_FIELDS = {
+    TASK_READING: "next_reading",
+    TASK_UPLOAD: "next_upload",
+    TASK_LOG_SHIP: "next_log_ship",
+}
+
+
+class Scheduler:
+    """
+    Keeps track of when each periodic task is next due, and works out when the board
+    next needs to wake.
+
+    Readings are taken at fixed times, every READING_FREQUENCY minutes, stretched by
+    the energy policy when the battery is low. Other tasks are run at the first
+    wake after they're due. If that would mean waking just for them, they're run
+    early in a wake up to SCHEDULE_COALESCE_MINUTES before, or left for the next
+    reading if that's due within SCHEDULE_COALESCE_MINUTES after
+
+    Args:
+        logger (Logging): Logging controller for logging info to file
+        state (State): Persistent state, used to keep due times between wakes
+        energy (EnergyPolicy): Energy policy, which can stretch the time between
+        readings and uploads
+    """
+
+    def __init__(self, logger, state, energy):
+        self.__logger = logger
+        self.__state = state
+        self.__energy = energy
+
+    def __interval(self, task):
+        """
+        Get how often a task runs
+
+        Args:
+            task (int): Task as defined in utils.constants
+
+        Returns:
+            int: Time between runs in seconds
+        """
+        reading_interval = READING_FREQUENCY * 60 * self.__energy.reading_scale()
+        if task == TASK_READING:
+            return reading_interval
+        if task == TASK_UPLOAD:
+            return UPLOAD_FREQUENCY * self.__energy.upload_scale() * reading_interval
+        if task == TASK_RESYNC:
+            return RTC_RESYNC_FREQUENCY * 60 * 60
+        return LOG_SHIP_FREQUENCY * 60 * 60
+
+    def __next_reading_slot(self, after):
+        """
+        Get the next fixed reading time after a time, skipping it if it's so close
+        it's probably the one that's just been taken
+
+        Args:
+            after (int): Epoch time
+
+        Returns:
+            int: Epoch time of the next reading
+        """
+        interval = self.__interval(TASK_READING)
+        slot = (after // interval + 1) * interval
+        if slot - after < SCHEDULE_SLACK_SECONDS:
+            slot += interval
+        return slot
+
+    def due_time(self, task):
+        """
+        Get when a task is next due
+
+        Args:
+            task (int): Task as defined in utils.constants
+
+        Returns:
+            int: Epoch time the task is due, 0 if due straight away
+        """
+        interval = self.__interval(task)
+        if task == TASK_RESYNC:
+            last_sync = self.__state["last_rtc_sync"]
+            return last_sync + interval if last_sync else 0
+
+        now_ts = now()
+        field = DUE_FIELDS[task]
+        due = self.__state[field]
+        # Due times too far ahead are left over from before the clock was corrected
+        if due > now_ts + interval:
+            due = 0
+        # Take the first reading straight away, but wait a full interval for the rest
+        if not due and task != TASK_READING:
+            due = now_ts + interval
+            self.__state[field] = due
+        return due
+
+    def is_due(self, task):
+        """
+        Check if a task should be run this wake. Readings are only taken at their
+        fixed times, other tasks are run early only if they'd otherwise need a wake of
+        their own before the next reading
+
+        Args:
+            task (int): Task as defined in utils.constants
+
+        Returns:
+            bool: True if the task should be run
+        """
+        now_ts = now()
+        due = self.due_time(task)
+        if due <= now_ts + SCHEDULE_SLACK_SECONDS:
+            return True
+        if task == TASK_READING:
+            return False
+
+        # Tasks due shortly before the next reading are left for that wake, see
+        # next_wake, so only anything due before then is worth running early
+        coalesce = SCHEDULE_COALESCE_MINUTES * 60
+        next_reading = self.due_time(TASK_READING)
+        return due <= now_ts + coalesce and due < next_reading - coalesce
+
+    def run_now(self, task):
+        """
+        Make a task due straight away, e.g. to take a reading on a button press
+
+        Args:
+            task (int): Task as defined in utils.constants
+        """
+        if task in DUE_FIELDS:
+            self.__state[DUE_FIELDS[task]] = now()
+
+    def done(self, task, again_next_wake=False):
+        """
+        Record that a task has been run, scheduling when it's next due. The next due
+        time follows on from when it was due, not when it ran, so running it early or
+        late doesn't drift the schedule
+
+        Args:
+            task (int): Task as defined in utils.constants
+            again_next_wake (bool): Run the task again at the next reading, e.g. if
+            there's still a backlog of readings to upload
+        """
+        if task not in DUE_FIELDS:
+            return
+
+        now_ts = now()
+        if task == TASK_READING:
+            due = self.__next_reading_slot(now_ts)
+        elif again_next_wake:
+            due = self.due_time(TASK_READING)
+        else:
+            interval = self.__interval(task)
+            due = self.due_time(task) + interval
+            # Don't try to catch up on runs missed while it couldn't run
+            if due <= now_ts:
+                due = now_ts + interval
+        self.__state[DUE_FIELDS[task]] = due
+        self.__logger.debug("- Next {} due at {}", TASK_NAMES[task], iso(due))
+
+    def next_wake(self):
+        """
+        Work out when the board next needs to wake.
+
+        That's the next reading, unless another task is due before then. Tasks due
+        shortly before the next reading are left for that wake, and overdue tasks
+        are retried at it. If the reading is overdue, e.g. because taking it failed,
+        it's retried at the next reading time rather than straight away
+
+        Returns:
+            int: Epoch time to wake at, rounded up to a whole minute
+        """
+        now_ts = now()
+        wake = self.due_time(TASK_READING)
+        if wake <= now_ts:
+            wake = self.__next_reading_slot(now_ts)
+        reason = TASK_READING
+        coalesce = SCHEDULE_COALESCE_MINUTES * 60
+
+        for task in (TASK_UPLOAD, TASK_RESYNC, TASK_LOG_SHIP):
+            due = self.due_time(task)
+            if now_ts < due < wake - coalesce:
+                wake = due
+                reason = task
+
+        # The RTC alarm can only be set to whole minutes
+        wake = max(wake, now_ts + 60)
+        wake = (wake + 59) // 60 * 60
+        self.__logger.debug("- Next wake is for {}", TASK_NAMES[reason])
+        return wake
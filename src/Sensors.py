@@ -1,22 +1,23 @@
-from os import remove
 from machine import Pin
-from time import sleep_ms, ticks_ms, ticks_diff
-from math import pi
+from time import sleep_ms, ticks_diff, ticks_ms
+from math import atan2, cos, degrees, radians, sin, sqrt
 from pimoroni import Analog
+import uasyncio
 from ucollections import OrderedDict
 from breakout_bme280 import BreakoutBME280
 from breakout_ltr559 import BreakoutLTR559
 from utils.constants import (
     RAIN_MM_PER_TICK,
     RAIN_PIN,
+    WIND_DIR_DEADLINE_MS,
+    WIND_DIR_INTERVAL_MS,
     WIND_DIR_PIN,
-    WIND_SPEED_PIN,
-    WIND_RADIUS_CM,
-    WIND_FACTOR,
+    WIND_DIR_SAMPLES,
+    WIND_DIR_VOLTAGES,
 )
-from utils.datetime_string import datetime_string
-from utils.file_exists import file_exists
-from utils.timestamp import timestamp
+from utils.clock import iso, now
+from Anemometer import Anemometer
+from RainBuffer import RainBuffer
 
 
 class Sensors:
@@ -27,108 +28,83 @@ class Sensors:
         logger (Logging): Logging controller for logging info to file
         i2c (PimoroniI2C): I2C controller for passing to sensor controllers,
         act_led (ActivityLED): Controller for controlling activity LED on enviro board
+        state (State): Persistent state, used to keep track of the last reading time
+        profiler (Profiler): Profiler to time sensor reads with
     """
 
-    def __init__(self, logger, i2c, act_led):
+    def __init__(self, logger, i2c, act_led, state, profiler):
         self.__logger = logger
+        self.__state = state
+        self.__profiler = profiler
         self.__bme280 = BreakoutBME280(i2c, 0x77)
         self.__ltr559 = BreakoutLTR559(i2c)
-        self.__wind_speed_pin = Pin(WIND_SPEED_PIN, Pin.IN, Pin.PULL_UP)
+        # Start counting anemometer pulses straight away so the sample builds up
+        # while everything else is initialised
+        self.__anemometer = Anemometer()
+        self.__anemometer.start()
         self.__wind_dir_pin = Analog(WIND_DIR_PIN)
+        # Precompute the voltage thresholds between headings and the unit vector of
+        # each heading, both in order of voltage, so samples can be classified and
+        # averaged without searching every heading
+        voltages = sorted((v, i * 45) for i, v in enumerate(WIND_DIR_VOLTAGES))
+        self.__wind_dir_thresholds = [
+            (voltages[i][0] + voltages[i + 1][0]) / 2 for i in range(len(voltages) - 1)
+        ]
+        self.__wind_dir_vectors = [
+            (sin(radians(heading)), cos(radians(heading))) for _, heading in voltages
+        ]
         self.__rain_pin = Pin(RAIN_PIN, Pin.IN, Pin.PULL_DOWN)
         self.__prev_rain_trigger = False
+        self.__rain_buffer = RainBuffer()
         self.__activity_led = act_led
+        self.__timings = {}
 
-    def __get_wind_speed(self, sample_time_ms=1000):
-        """
-        Calculate wind speed from anemometer.
-
-        Track the number of times the value from the anemometer changes within a
-        certain time period (`sample_time_ms`) and the amount of time between
-        those changes.
-
-        Args:
-          sample_time_ms (int): ms to monitor anemometer output for
-
-        Returns:
-          int: wind speed in m/s
-        """
-        # Get initial sensor value
-        state_val = self.__wind_speed_pin.value()
-
-        # Array to log times sensor value changes
-        ticks = []
-
-        start = ticks_ms()
-
-        # Get values from the anemometer for duration of sample_time_ms
-        while ticks_diff(ticks_ms(), start) <= sample_time_ms:
-            cur_val = self.__wind_speed_pin.value()
-            if cur_val != state_val:
-                # If value has changed, record time of change and update state_val
-                ticks.append(ticks_ms())
-                state_val = cur_val
-
-        # If anemometer isn't connected there won't be any extra ticks, so skip everything else
-        if len(ticks) < 2:
-            return 0
-
-        # Calculate the average tick time between changes (in ms)
-        average_tick_ms = (ticks_diff(ticks[-1], ticks[0])) / (len(ticks) - 1)
-
-        # Just in case the average is 0, skip the rest to avoid division errors
-        if average_tick_ms == 0:
-            return 0
-
-        # Work out the rotation speed in Hz (2 ticks per rotation)
-        rotation_hz = (1000 / average_tick_ms) / 2
-
-        # Calculate the wind speed in metres per second
-        circumference = WIND_RADIUS_CM * 2.0 * pi
-        wind_speed = rotation_hz * circumference * WIND_FACTOR
-
-        return wind_speed
-
-    def __get_wind_dir(self):
+    async def __get_wind_dir(self):
         """
         Gets wind direction heading.
 
-        Converts the voltage reading given by the wind direction pin into degrees.
-        Finds the closest value from an array of 45 degree heading increments and returns it
+        Takes up to WIND_DIR_SAMPLES readings from the wind direction pin at a fixed
+        rate, stopping early if WIND_DIR_DEADLINE_MS is reached. Each voltage reading is
+        classified into a 45 degree heading using the precomputed thresholds, then the
+        headings are vector averaged to get the mean direction. Yields to other sensor
+        reads between samples
 
         Note:
           The wind direction is read using Pimoroni's own Analog class, which does some
           skullduggery behind the scenes to correct the returned values a bit
 
         Returns:
-          int: Wind direction heading in degrees
+          int, float: Mean wind direction heading in degrees, Circular variance of the
+          samples between 0 (steady) and 1 (completely variable)
         """
-        ADC_TO_DEGREES = (0.9, 2.0, 3.0, 2.8, 2.5, 1.5, 0.3, 0.6)
-
-        closest_index = -1
-        last_index = None
+        thresholds = self.__wind_dir_thresholds
+        samples = 0
+        x = 0
+        y = 0
 
-        # Make sure there are 2 readings in a row that much as if readings are taken
-        # during transition between two values it can bug out
-        while True:
+        start = ticks_ms()
+        while samples < WIND_DIR_SAMPLES:
             value = self.__wind_dir_pin.read_voltage()
 
-            closest_index = -1
-            closest_value = float("inf")
+            # Find which heading the voltage falls into
+            i = 0
+            while i < len(thresholds) and value > thresholds[i]:
+                i += 1
 
-            for i in range(8):
-                distance = abs(ADC_TO_DEGREES[i] - value)
-                if distance < closest_value:
-                    closest_value = distance
-                    closest_index = i
+            x += self.__wind_dir_vectors[i][0]
+            y += self.__wind_dir_vectors[i][1]
+            samples += 1
 
-            # If 2 matching values in a row, exit the loop
-            if last_index == closest_index:
+            # Stop early rather than run past the deadline
+            elapsed = ticks_diff(ticks_ms(), start)
+            if elapsed + WIND_DIR_INTERVAL_MS > WIND_DIR_DEADLINE_MS:
                 break
+            await uasyncio.sleep_ms(WIND_DIR_INTERVAL_MS)
 
-            last_index = closest_index
-
-        return closest_index * 45
+        # Length of the mean vector is 1 if every sample agreed
+        mean_length = sqrt(x * x + y * y) / samples
+        direction = round(degrees(atan2(x, y))) % 360
+        return direction, round(1 - mean_length, 3)
 
     def check_rain_sensor(self, wakeup=False):
         """
@@ -151,24 +127,9 @@ class Sensors:
             sleep_ms(50)
             self.__activity_led.set_brightness(0)
 
-            # Read in current rain entries
-            rain_entries = []
-            if file_exists("rain.txt"):
-                with open("rain.txt", "r") as rainfile:
-                    rain_entries = rainfile.read().split("\n")
-
-            # Add the new entry
-            dt_str = datetime_string()
-            self.__logger.info(f"Adding new rain trigger at {dt_str}")
-            rain_entries.append(dt_str)
-
-            # Limit number of entries to 190; each entry is ~21 bytes including newline
-            # so this keeps total filesize to just under one filesystem block (4096 bytes)
-            rain_entries = rain_entries[-190:]
-
-            # Write the new rain log
-            with open("rain.txt", "w") as rainfile:
-                rainfile.write("\n".join(rain_entries))
+            now_ts = now()
+            self.__logger.info("Adding new rain trigger at", iso(now_ts))
+            self.__rain_buffer.record(now_ts)
 
         self.__prev_rain_trigger = True if wakeup else rain_val
 
@@ -186,21 +147,11 @@ class Sensors:
         """
         rain_amount = 0
         per_second = 0
-        cur_timestamp = timestamp(datetime_string())
 
-        if file_exists("rain.txt"):
-            with open("rain.txt", "r") as rainfile:
-                rain_entries = rainfile.read().split("\n")
-
-            # Count how many rain entries there have been since the last reading
-            for entry in rain_entries:
-                if entry:
-                    ts = timestamp(entry)
-                    if cur_timestamp - ts < seconds_since_last:
-                        rain_amount += RAIN_MM_PER_TICK
-
-            # Once done, remove rain.txt to clear old readings
-            remove("rain.txt")
+        # Count how many tips there have been since the last reading
+        if seconds_since_last > 0:
+            since = now() - seconds_since_last
+            rain_amount = self.__rain_buffer.count_since(since) * RAIN_MM_PER_TICK
 
         # If it's rained at all, calculate rain per second
         if rain_amount > 0 and seconds_since_last > 0:
@@ -208,6 +159,97 @@ class Sensors:
 
         return rain_amount, per_second
 
+    async def __timed(self, name, coro):
+        """
+        Await a sensor read, recording how long it took
+
+        Args:
+            name (str): Name to record the timing under
+            coro (coroutine): Sensor read to await
+
+        Returns:
+            Result of the sensor read
+        """
+        start = ticks_ms()
+        result = await coro
+        self.__timings[name] = ticks_diff(ticks_ms(), start)
+        return result
+
+    async def __read_bme280(self):
+        """
+        Read the BME280, yielding to other sensor reads while it settles
+
+        Returns:
+            tuple: temperature, pressure and humidity data
+        """
+        # The BME280 returns the register contents first and then takes a new reading
+        # so run a dummy read first to discard register contents and get current data
+        self.__bme280.read()
+        await uasyncio.sleep_ms(100)
+        return self.__bme280.read()
+
+    async def __read_ltr559(self):
+        """
+        Read the LTR559
+
+        Returns:
+            tuple: light sensor data
+        """
+        return self.__ltr559.get_reading()
+
+    async def __read_wind_speed(self):
+        """
+        Read wind speed, yielding to other sensor reads until the anemometer sample
+        window is complete
+
+        Returns:
+            float, float, float: mean wind speed, gust and lull in m/s
+        """
+        remaining = self.__anemometer.remaining_ms()
+        if remaining:
+            await uasyncio.sleep_ms(remaining)
+        return self.__anemometer.get_wind()
+
+    async def __read_rainfall(self, seconds_since_last):
+        """
+        Read rainfall since the last reading from the rain buffer
+
+        Args:
+            seconds_since_last (int): Seconds since the last reading was taken
+
+        Returns:
+            float, float: Amount of rainfall in mm, Rate of rainfall in mm/s
+        """
+        return self.__get_rainfall(seconds_since_last)
+
+    async def __read_all(self, seconds_since_last):
+        """
+        Read all sensors concurrently, so the total time taken is that of the
+        slowest sensor rather than all of them added together
+
+        Args:
+            seconds_since_last (int): Seconds since the last reading was taken
+
+        Returns:
+            list: Results of each sensor read
+        """
+        return await uasyncio.gather(
+            self.__timed("bme280", self.__read_bme280()),
+            self.__timed("ltr559", self.__read_ltr559()),
+            self.__timed("wind_speed", self.__read_wind_speed()),
+            self.__timed("wind_direction", self.__get_wind_dir()),
+            self.__timed("rain", self.__read_rainfall(seconds_since_last)),
+        )
+
+    def get_timings(self):
+        """
+        Get how long each sensor took to read during the last reading
+
+        Returns:
+          dict: ms taken by each sensor read, plus the total
+        """
+        return self.__timings
+
     def get_sensor_readings(self):
         """
         Take readings from all sensors and return a dict containing them
@@ -216,9 +258,6 @@ class Sensors:
           May eventually want to add temperature compensation for running
           on USB power heating things up
 
-        Args:
-            seconds_since_last (int): Seconds elapsed since last reading was taken
-
         Returns:
           dict (OrderedDict): sensor readings
         """
@@ -226,26 +265,23 @@ class Sensors:
 
         seconds_since_last = 0
 
-        now_str = datetime_string()
-        if file_exists("last_reading_time.txt"):
-            now_ts = timestamp(now_str)
-
-            with open("last_reading_time.txt", "r") as timefile:
-                last_time = timefile.readline()
-                last_ts = timestamp(last_time)
+        now_ts = now()
+        if self.__state["last_reading_time"]:
+            seconds_since_last = now_ts - self.__state["last_reading_time"]
+            self.__logger.info("- Seconds since last reading:", seconds_since_last)
 
-            seconds_since_last = now_ts - last_ts
-            self.__logger.info(f"- Seconds since last reading: {seconds_since_last}")
-
-        # The BME280 returns the register contents first and then takes a new reading
-        # so run a dummy read first to discard register contents and get current data
-        self.__bme280.read()
-        sleep_ms(100)
-        bme280_data = self.__bme280.read()
-        ltr_data = self.__ltr559.get_reading()
-        wind_speed = self.__get_wind_speed()
-        wind_direction = self.__get_wind_dir()
-        rain, rain_per_second = self.__get_rainfall(seconds_since_last)
+        self.__timings = {}
+        start = ticks_ms()
+        with self.__profiler.phase("sensors"):
+            (
+                bme280_data,
+                ltr_data,
+                (wind_speed, wind_gust, wind_lull),
+                (wind_direction, wind_direction_variance),
+                (rain, rain_per_second),
+            ) = uasyncio.run(self.__read_all(seconds_since_last))
+        self.__timings["total"] = ticks_diff(ticks_ms(), start)
+        self.__logger.debug("- Sensor read timings (ms):", self.__timings)
 
         readings_data = OrderedDict(
             [
@@ -257,14 +293,16 @@ class Sensors:
                     round(ltr_data[BreakoutLTR559.LUX] if ltr_data else 0, 2),
                 ),
                 ("wind_speed", wind_speed),
+                ("wind_gust", wind_gust),
+                ("wind_lull", wind_lull),
                 ("rain", rain),
                 ("rain_per_second", rain_per_second),
                 ("wind_direction", wind_direction),
+                ("wind_direction_variance", wind_direction_variance),
             ]
         )
 
         # Log time of reading for next time
-        with open("last_reading_time.txt", "w") as timefile:
-            timefile.write(now_str)
+        self.__state["last_reading_time"] = now_ts
 
         return readings_data
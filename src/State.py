@@ -0,0 +1,172 @@
+from os import remove, rename
+from struct import calcsize, pack_into, unpack_from
+from ubinascii import crc32
+from utils.file_exists import file_exists
+
+# Profiler stats for each phase: min, mean and max in µs, sample count, histogram
+PROFILE_FORMAT = "3IH8H"
+PROFILE_DEFAULT = [0] * 12
+# Profiler heap usage for each phase: lowest free, highest allocated, collections
+PROFILE_MEMORY_FORMAT = "3I"
+PROFILE_MEMORY_DEFAULT = [0] * 3
+
+# Persistent state fields in record order, with their struct format and default value.
+# New fields must only ever be appended to the end so state saved by older firmware
+# can still be read, with any new fields set to their defaults
+STATE_FIELDS = (
+    ("wake_count", "I", 0),
+    ("last_reading_time", "I", 0),
+    ("last_rtc_sync", "I", 0),
+    ("log_cursor", "I", 0),
+    ("log_base", "I", 0),
+    ("readings_queued", "I", 0),
+    ("readings_uploaded", "I", 0),
+    ("upload_failures", "H", 0),
+    ("wifi_bssid", "6s", bytes(6)),
+    ("wifi_channel", "B", 0),
+    ("wifi_ip", "4s", bytes(4)),
+    ("wifi_netmask", "4s", bytes(4)),
+    ("wifi_gateway", "4s", bytes(4)),
+    ("wifi_dns", "4s", bytes(4)),
+    ("wifi_lease_time", "I", 0),
+    ("upload_breaker", "B", 0),
+    ("upload_retry_at", "I", 0),
+    ("next_reading", "I", 0),
+    ("next_upload", "I", 0),
+    ("next_log_ship", "I", 0),
+    ("voltage_smoothed", "f", 0.0),
+    ("energy_tier", "B", 0),
+    ("profile_boot", PROFILE_FORMAT, PROFILE_DEFAULT),
+    ("profile_init", PROFILE_FORMAT, PROFILE_DEFAULT),
+    ("profile_sensors", PROFILE_FORMAT, PROFILE_DEFAULT),
+    ("profile_cache", PROFILE_FORMAT, PROFILE_DEFAULT),
+    ("profile_connect", PROFILE_FORMAT, PROFILE_DEFAULT),
+    ("profile_ntp", PROFILE_FORMAT, PROFILE_DEFAULT),
+    ("profile_post", PROFILE_FORMAT, PROFILE_DEFAULT),
+    ("profile_disconnect", PROFILE_FORMAT, PROFILE_DEFAULT),
+    ("profile_wake", PROFILE_FORMAT, PROFILE_DEFAULT),
+    ("profile_rotate", PROFILE_FORMAT, PROFILE_DEFAULT),
+    ("memory_init", PROFILE_MEMORY_FORMAT, PROFILE_MEMORY_DEFAULT),
+    ("memory_sensors", PROFILE_MEMORY_FORMAT, PROFILE_MEMORY_DEFAULT),
+    ("memory_cache", PROFILE_MEMORY_FORMAT, PROFILE_MEMORY_DEFAULT),
+    ("memory_connect", PROFILE_MEMORY_FORMAT, PROFILE_MEMORY_DEFAULT),
+    ("memory_ntp", PROFILE_MEMORY_FORMAT, PROFILE_MEMORY_DEFAULT),
+    ("memory_post", PROFILE_MEMORY_FORMAT, PROFILE_MEMORY_DEFAULT),
+    ("memory_disconnect", PROFILE_MEMORY_FORMAT, PROFILE_MEMORY_DEFAULT),
+    ("memory_rotate", PROFILE_MEMORY_FORMAT, PROFILE_MEMORY_DEFAULT),
+)
+
+# Header layout: magic, layout version, body length, body checksum
+HEADER_FORMAT = "<4sBHI"
+HEADER_SIZE = calcsize(HEADER_FORMAT)
+HEADER_MAGIC = b"WVST"
+# Only needs bumping if existing fields change, appending fields doesn't need it
+LAYOUT_VERSION = 1
+
+BODY_FORMAT = "<" + "".join(fmt for _, fmt, _ in STATE_FIELDS)
+BODY_SIZE = calcsize(BODY_FORMAT)
+
+# Files replaced by the state store, removed when it's first created
+LEGACY_FILES = ("last_reading_time.txt", "last_rtc_sync.txt")
+
+
+class State:
+    """
+    Persistent bookkeeping state kept between wakes.
+
+    All state is loaded with a single read at boot, then saved atomically once at the
+    end of the wake as one small record with a checksum. Values are accessed by field
+    name, e.g. `state["last_reading_time"]`
+    """
+
+    def __init__(self):
+        self.__state_file = "state.bin"
+        self.__values = {name: default for name, _, default in STATE_FIELDS}
+        self.__valid = self.__load()
+
+        if not self.__valid and not file_exists(self.__state_file):
+            for file in LEGACY_FILES:
+                if file_exists(file):
+                    remove(file)
+
+    def __load(self):
+        """
+        Load state from the state file
+
+        Returns:
+          bool: True if loaded, False if the state file is missing or invalid
+        """
+        try:
+            with open(self.__state_file, "rb") as statefile:
+                data = statefile.read()
+            magic, version, length, checksum = unpack_from(HEADER_FORMAT, data)
+        except (OSError, ValueError):
+            return False
+
+        body = data[HEADER_SIZE : HEADER_SIZE + length]
+        if (
+            magic != HEADER_MAGIC
+            or version != LAYOUT_VERSION
+            or len(body) != length
+            or crc32(body) != checksum
+        ):
+            return False
+
+        # Fields missing from state saved by older firmware keep their defaults
+        offset = 0
+        for name, fmt, _ in STATE_FIELDS:
+            size = calcsize("<" + fmt)
+            if offset + size > length:
+                break
+            values = unpack_from("<" + fmt, body, offset)
+            self.__values[name] = values[0] if len(values) == 1 else list(values)
+            offset += size
+
+        return True
+
+    def is_valid(self):
+        """
+        Check if state was loaded successfully at boot
+
+        Returns:
+          bool: True if loaded, False if starting from defaults
+        """
+        return self.__valid
+
+    def __getitem__(self, name):
+        return self.__values[name]
+
+    def __setitem__(self, name, value):
+        if name not in self.__values:
+            raise KeyError(name)
+        self.__values[name] = value
+
+    def save(self):
+        """
+        Save state to the state file. Written to a temporary file first and then
+        renamed over the old one, so the state file is never left half written
+        """
+        data = bytearray(HEADER_SIZE + BODY_SIZE)
+        offset = HEADER_SIZE
+        for name, fmt, _ in STATE_FIELDS:
+            value = self.__values[name]
+            if isinstance(value, list):
+                pack_into("<" + fmt, data, offset, *value)
+            else:
+                pack_into("<" + fmt, data, offset, value)
+            offset += calcsize("<" + fmt)
+
+        body = memoryview(data)[HEADER_SIZE:]
+        pack_into(
+            HEADER_FORMAT,
+            data,
+            0,
+            HEADER_MAGIC,
+            LAYOUT_VERSION,
+            BODY_SIZE,
+            crc32(body),
+        )
+
+        with open(self.__state_file + ".tmp", "wb") as statefile:
+            statefile.write(data)
+        rename(self.__state_file + ".tmp", self.__state_file)
@@ -1,17 +1,11 @@
 from os import statvfs
 from io import StringIO
 from machine import ADC, Pin, RTC, idle, reset, mem32
-from time import sleep_ms
+from time import gmtime, sleep_ms, ticks_us
 from pimoroni_i2c import PimoroniI2C
 from pcf85063a import PCF85063A
 from wakeup import get_gpio_state
-from ujson import dumps
 from sys import print_exception
-from utils.config import (
-    NICKNAME,
-    READING_FREQUENCY,
-    RTC_RESYNC_FREQUENCY,
-)
 from utils.constants import (
     ADC_VOLT_CONVERSION,
     BUTTON_PIN,
@@ -20,6 +14,9 @@ from utils.constants import (
     I2C_SCL_PIN,
     RAIN_PIN,
     RTC_ALARM_PIN,
+    TASK_LOG_SHIP,
+    TASK_READING,
+    TASK_UPLOAD,
     WAKE_BUTTON_PRESS,
     WAKE_RAIN_TRIGGER,
     WAKE_REASON_NAMES,
@@ -30,14 +27,17 @@ from utils.constants import (
     WARN_LED_ON,
     WIFI_CS_PIN,
 )
-from utils.datetime_string import datetime_string
-from utils.file_exists import file_exists
-from utils.makedir import makedir
-from utils.timestamp import timestamp
-from utils.uid import uid
+from utils.clock import iso, now, sync
+from State import State
+from Profiler import Profiler
 from Logging import Logging
 from ActivityLED import ActivityLED
 from Sensors import Sensors
+from ReadingQueue import ReadingQueue
+from RainBuffer import RainBuffer
+from CircuitBreaker import CircuitBreaker
+from Scheduler import Scheduler
+from EnergyPolicy import EnergyPolicy
 from Networking import Networking
 
 
@@ -46,34 +46,62 @@ class Weathervane:
     Handles overall functionality of the enviro board
 
     Attributes:
+        state (State): Persistent state kept between wakes
         logger (Logging): Logger for saving log output to file
         button (Pin): The button on the front of the enviro itself
         i2c (PimoroniI2C): I2C controller for GPIO devices
         rtc (PCF85063A): Controller for RTC chip
         activity_led (ActivityLED): Controller for activity LED
         sensors (Sensors): For getting sensor data
+        queue (ReadingQueue): Queue of readings waiting to be uploaded
+        upload_breaker (CircuitBreaker): Decides whether uploads should be attempted
+        energy (EnergyPolicy): Decides how hard to work based on battery voltage
+        scheduler (Scheduler): Keeps track of when each task is next due
+        profiler (Profiler): Times each phase of the wake
     """
 
     def __init__(self):
         # Hold VSYS_EN pin high to keep power to the board when on battery
         self.__hold_vsys_en_pin = Pin(HOLD_VSYS_EN_PIN, Pin.OUT, value=True)
-        self.logger = Logging()
-        self.button = Pin(BUTTON_PIN, Pin.IN, Pin.PULL_DOWN)
-        # state of vbus to know if woken by USB
-        self.__vbus_present = Pin("WL_GPIO2", Pin.IN).value()
-        self.i2c = PimoroniI2C(I2C_SDA_PIN, I2C_SCL_PIN, 100000)
-        # initialise RTC chip
-        self.rtc = PCF85063A(self.i2c)
-        self.i2c.writeto_mem(0x51, 0x00, b"\x00")
-        self.rtc.enable_timer_interrupt(False)
-        t = self.rtc.datetime()
-        # sync pico's RTC to chip
-        RTC().datetime((t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0))
-        self.activity_led = ActivityLED()
-        self.sensors = Sensors(self.logger, self.i2c, self.activity_led)
-        self.networking = Networking(self.logger, self.__vbus_present)
-
-    def startup(self):
+        # load persistent state first as logging relies on it
+        self.state = State()
+        self.state["wake_count"] += 1
+        self.profiler = Profiler(self.state)
+        with self.profiler.phase("init"):
+            self.logger = Logging(self.state, self.profiler)
+            if not self.state.is_valid():
+                self.logger.warn("Persistent state missing or invalid, starting fresh")
+            self.energy = EnergyPolicy(self.logger, self.state)
+            self.scheduler = Scheduler(self.logger, self.state, self.energy)
+            self.button = Pin(BUTTON_PIN, Pin.IN, Pin.PULL_DOWN)
+            # state of vbus to know if woken by USB
+            self.__vbus_present = Pin("WL_GPIO2", Pin.IN).value()
+            self.i2c = PimoroniI2C(I2C_SDA_PIN, I2C_SCL_PIN, 100000)
+            # initialise RTC chip
+            self.rtc = PCF85063A(self.i2c)
+            self.i2c.writeto_mem(0x51, 0x00, b"\x00")
+            self.rtc.enable_timer_interrupt(False)
+            t = self.rtc.datetime()
+            # sync pico's RTC to chip
+            RTC().datetime((t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0))
+            # read the time once for the rest of the wake
+            sync()
+            self.activity_led = ActivityLED()
+            self.sensors = Sensors(
+                self.logger, self.i2c, self.activity_led, self.state, self.profiler
+            )
+            self.queue = ReadingQueue(self.logger)
+            self.upload_breaker = CircuitBreaker(self.logger, self.state)
+            self.networking = Networking(
+                self.logger,
+                self.__vbus_present,
+                self.queue,
+                self.state,
+                self.upload_breaker,
+                self.profiler,
+            )
+
+    def startup(self, rain_recorded=False):
         """
         Startup process.
 
@@ -81,6 +109,10 @@ class Weathervane:
         - If rain, cache reading and sleep
         - Else, continue with wake process
 
+        Args:
+            rain_recorded (bool): True if the rain trigger for this wake has already
+            been recorded by the minimal rain wake process
+
         Returns:
             bool: True if wake not rain triggered
         """
@@ -88,12 +120,22 @@ class Weathervane:
 
         reason = self.__get_wake_reason()
         self.logger.info(" - Wake reason: ", WAKE_REASON_NAMES[reason])
+        # Reading the rain buffer is only worth it if the entry will be kept
+        if self.logger.is_enabled("debug"):
+            self.logger.debug(
+                " - Rain wakes so far: {}, last took {}ms", *RainBuffer().wake_stats()
+            )
 
         # If woken by rain trigger, log and go back to sleep
         if reason == WAKE_RAIN_TRIGGER:
-            self.sensors.check_rain_sensor(True)
+            if not rain_recorded:
+                self.sensors.check_rain_sensor(True)
             self.sleep()
 
+        # Always take a reading when the button is pressed
+        if reason == WAKE_BUTTON_PRESS:
+            self.scheduler.run_now(TASK_READING)
+
         # Pulse activity LED to show board is active
         self.activity_led.pulse()
 
@@ -131,26 +173,20 @@ class Weathervane:
         self.rtc.clear_alarm_flag()
         self.rtc.clear_timer_flag()
 
-        # Set alarm for next scheduled reading
-        dt = self.rtc.datetime()
-        hour, minute, second = dt[3:6]
-
-        # Figure out what time the next reading should be at
-        minute += READING_FREQUENCY - (minute % READING_FREQUENCY)
-        if minute >= 60:
-            hour += 1
-            minute -= 60
-        if hour >= 24:
-            hour -= 24
-
-        self.logger.info(f"- Setting alarm to wake at {hour:02}:{minute:02}")
-
-        # Set RTC alarm
-        self.rtc.set_alarm(0, minute, hour)
+        # Set alarm for the next scheduled task, including the day so it works for
+        # any length of time up to a month
+        wake = self.scheduler.next_wake()
+        day, hour, minute, second = gmtime(wake)[2:6]
+        self.logger.info("- Setting alarm to wake at {}", iso(wake))
+        self.rtc.set_alarm(second, minute, hour, day)
         self.rtc.enable_alarm_interrupt(True)
 
         # Disable VSYS hold, cutting power to the pico (if on battery)
         self.logger.info("- Shutting down (if on battery)")
+        self.logger.flush()
+        # Time from reset to here is the whole wake
+        self.profiler.record("wake", ticks_us())
+        self.state.save()
         self.__hold_vsys_en_pin.init(Pin.IN)
 
         # If this code is reached it means power is coming from USB
@@ -168,77 +204,69 @@ class Weathervane:
                 self.logger.info("- Button pressed, resetting board")
                 break
 
+        self.logger.flush()
+        self.state.save()
         reset()
 
     def is_clock_set(self):
         """
-        Check if RTC chip clock is set correctly, and has been sync within
-        timeframe defined by RTC_RESYNC_FREQUENCY
+        Check if RTC chip clock has been set at all, so readings can be timestamped
 
         Returns:
-            bool: True if set correctly, False if not
+            bool: True if set, False if not
         """
         # If the year is on or before 2023, it's not set
-        if self.rtc.datetime()[0] <= 2023:
-            return False
-
-        # If last_rtc_sync.txt exists, check if that time is outside of RTC_RESYNC_FREQUENCY
-        if file_exists("last_rtc_sync.txt"):
-            now = timestamp(datetime_string())
+        return self.rtc.datetime()[0] > 2023
 
-            last_sync_time = ""
-            with open("last_rtc_sync.txt", "r") as syncfile:
-                last_sync_time = syncfile.readline()
-
-            sync_time = now
-            if len(last_sync_time) > 0:
-                sync_time = timestamp(last_sync_time)
+    def sync_clock(self):
+        """
+        Sync RTC chip clock from an NTP server. Must be run within a network session
 
-            seconds_since_sync = now - sync_time
+        Returns:
+            bool: True if RTC set correctly, False if not
+        """
+        return self.networking.sync_rtc_from_ntp(self.i2c, self.rtc)
 
-            if seconds_since_sync >= 0:
-                # Check it's not been longer since the specified resync frequency
-                if seconds_since_sync < (RTC_RESYNC_FREQUENCY * 60 * 60):
-                    return True
-                else:
-                    self.logger.warn(
-                        f"- RTC has not been synced for over {RTC_RESYNC_FREQUENCY} hours"
-                    )
-            return False
+    def upload(self):
+        """
+        Upload queued readings and schedule the next upload. If there's still a
+        backlog, it's uploaded again at the next reading. Must be run within a network
+        session
+        """
+        logs_shipped = self.networking.upload_readings()
+        self.scheduler.done(TASK_UPLOAD, again_next_wake=self.queue.count() > 0)
+        # Logs are shipped along with the readings, so if none were sent they're
+        # left due for the next upload
+        if logs_shipped:
+            self.scheduler.done(TASK_LOG_SHIP)
 
     def take_reading(self):
         """
         Get readings from sensors then cache to file
         """
         readings = self.sensors.get_sensor_readings()
-        self.cache_reading(readings)
+        with self.profiler.phase("cache"):
+            self.cache_reading(readings)
+        self.scheduler.done(TASK_READING)
 
     def cache_reading(self, readings):
         """
-        Cache reading locally for upload later
+        Queue reading locally for upload later
 
         Args:
             reading (dict): Readings dict to be cached
         """
         self.logger.info("Caching reading for upload")
-        # Add the logfile to cached reading to allow for remote diagnostics
-        with open("log.txt", "r") as logfile:
-            logs = logfile.read()
-            voltage = self.get_voltage()
-            cache_payload = {
-                "nickname": NICKNAME,
-                "timestamp": datetime_string(),
-                "readings": readings,
-                "model": "weather",
-                "uid": uid(),
-                "logs": logs,
-                "voltage": voltage,
-            }
-
-            uploads_filename = f"uploads/{datetime_string(for_filename=True)}.json"
-            makedir("uploads")
-            with open(uploads_filename, "w") as upload_file:
-                upload_file.write(dumps(cache_payload))
+        voltage = self.get_voltage()
+        self.energy.update(voltage)
+        reading = {
+            "timestamp": now(),
+            "voltage": voltage,
+            "energy_tier": self.energy.tier(),
+        }
+        reading.update(readings)
+        self.queue.append(reading)
+        self.state["readings_queued"] += 1
 
     def set_warn_led(self, state):
         """
@@ -265,6 +293,7 @@ class Weathervane:
             message (str): The error message to be logged
         """
         self.logger.error(message)
+        self.logger.flush()
         self.set_warn_led(WARN_LED_BLINK)
         self.sleep()
 
@@ -281,6 +310,7 @@ class Weathervane:
         buf = StringIO()
         print_exception(exc, buf)
         self.logger.exception("! - " + buf.getvalue())
+        self.logger.flush()
         self.set_warn_led(WARN_LED_BLINK)
         self.sleep()
 
@@ -297,8 +327,8 @@ class Weathervane:
         """
         Gets the current voltage of the battery power source.
 
-        In order to do this on the pico, the wifi has to be disabled temporarily
-        as the wifi and voltage reading capabilities share the same pin
+        On the pico the wifi and voltage reading share the same pin, so this must be
+        called while the wifi radio is powered down, i.e. outside a network session
 
         Note:
             If the board is on USB power, it will always return ~5ish
@@ -308,19 +338,13 @@ class Weathervane:
         """
         conversion_factor = 3 * ADC_VOLT_CONVERSION
         try:
-            if self.networking.__wlan is not None:
-                self.networking.__wlan.active(False)
-                self.networking.__wlan.deinit()
-
             Pin(25, mode=Pin.OUT, pull=Pin.PULL_DOWN).high()
 
             Pin(29, Pin.IN)
 
             vsys = ADC(29)
             voltage = vsys.read_u16() * conversion_factor
-            self.logger.debug(f"Voltage: {voltage}")
+            self.logger.debug("Voltage: {}", voltage)
             return voltage
         finally:
             Pin(29, Pin.ALT, pull=Pin.PULL_DOWN, alt=7)
-            if self.networking.__wlan is not None:
-                self.networking.__wlan.active(True)
@@ -1,8 +1,26 @@
 from time import sleep_ms
+from wakeup import get_gpio_state
+from utils.constants import BUTTON_PIN, RAIN_PIN, RTC_ALARM_PIN
+
+# If woken only by the rain sensor, take the minimal path which records the tip
+# and cuts power straight away. It only returns if on USB power
+rain_recorded = False
+gpio_state = get_gpio_state()
+if gpio_state & (1 << RAIN_PIN) and not (
+    gpio_state & ((1 << BUTTON_PIN) | (1 << RTC_ALARM_PIN))
+):
+    from rain_wake import rain_wake
+
+    rain_recorded = rain_wake()
+
 from Weathervane import Weathervane
-from utils.constants import WARN_LED_OFF
-from utils.config import UPLOAD_FREQUENCY
-from utils.cached_reading_count import cached_reading_count
+from utils.constants import (
+    TASK_LOG_SHIP,
+    TASK_READING,
+    TASK_RESYNC,
+    TASK_UPLOAD,
+    WARN_LED_OFF,
+)
 
 # Sleep for 0.5 seconds to fix https://github.com/micropython/micropython/issues/9605
 sleep_ms(500)
@@ -14,29 +32,49 @@ try:
     station.set_warn_led(WARN_LED_OFF)
 
     # Initial startup process
-    station.startup()
+    station.startup(rain_recorded)
 
-    # Make sure RTC chip is set correctly
+    # If the RTC chip has lost the time, sync it before taking a reading so the
+    # reading is timestamped correctly
     if not station.is_clock_set():
         station.logger.info("RTC not set, syncing from NTP server")
-        clock_set = station.networking.sync_rtc_from_ntp(station.i2c, station.rtc)
+        clock_set = station.networking.run_session([station.sync_clock])[0]
         if not clock_set:
             station.error("- Failed to synchronise RTC")
 
     # Log space remaining in pico storage
     station.space_remaining()
 
-    # Take readings from sensors and cache them
-    station.take_reading()
+    # Take readings from sensors and cache them. The voltage is read as part of the
+    # reading, before wifi is powered up
+    if station.scheduler.is_due(TASK_READING):
+        station.take_reading()
 
-    cache_count = cached_reading_count()
-    if cache_count >= UPLOAD_FREQUENCY:
-        station.logger.info(f"{cache_count} cached readings to upload")
-        station.networking.upload_readings()
+    # Collect everything else needing the network so it's done in one wifi session
+    network_tasks = []
+    uploading = False
+    if station.scheduler.is_due(TASK_RESYNC):
+        station.logger.info("RTC resync due")
+        network_tasks.append(station.sync_clock)
+
+    cache_count = station.queue.count()
+    upload_due = station.scheduler.is_due(TASK_UPLOAD)
+    if not (upload_due or station.scheduler.is_due(TASK_LOG_SHIP)):
+        station.logger.info("{} cached readings waiting for next upload", cache_count)
+    elif not cache_count:
+        # Logs are shipped attached to a reading, so leave them for the next upload
+        station.logger.info("Upload due, but no cached readings to upload")
+        if upload_due:
+            station.scheduler.done(TASK_UPLOAD)
     else:
-        station.logger.info(
-            f"Not enough cached readings to upload ({cache_count} readings). Waiting until there are {UPLOAD_FREQUENCY} readings"
-        )
+        station.logger.info("Upload due, {} cached readings to upload", cache_count)
+        # Don't power up wifi at all while the upload endpoint is backing off
+        if station.upload_breaker.allow():
+            network_tasks.append(station.upload)
+            uploading = True
+
+    if network_tasks:
+        station.networking.run_session(network_tasks, uploading)
 
     station.sleep()
 
@@ -0,0 +1,51 @@
+from machine import Pin, RTC
+from sys import print_exception
+from time import ticks_ms
+from pimoroni_i2c import PimoroniI2C
+from pcf85063a import PCF85063A
+from utils.clock import now, sync
+from utils.constants import HOLD_VSYS_EN_PIN, I2C_SDA_PIN, I2C_SCL_PIN
+from RainBuffer import RainBuffer
+
+
+def rain_wake():
+    """
+    Minimal wake process for when the board is woken by the rain sensor.
+
+    Records the rain tip and cuts power again, only initialising the RTC chip to get
+    the time of the tip. Skips the sensors, activity LED, logging and networking
+    entirely as in wet weather these wakes far outnumber scheduled ones
+
+    Note:
+      If on USB power, cutting power has no effect and this returns, after which the
+      normal wake process should continue
+
+    Returns:
+      bool: True if the tip was recorded, False if recording it failed
+    """
+    # Hold VSYS_EN pin high to keep power to the board when on battery
+    hold_vsys_en_pin = Pin(HOLD_VSYS_EN_PIN, Pin.OUT, value=True)
+
+    recorded = False
+    try:
+        i2c = PimoroniI2C(I2C_SDA_PIN, I2C_SCL_PIN, 100000)
+        t = PCF85063A(i2c).datetime()
+        # sync pico's RTC to chip
+        RTC().datetime((t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0))
+        sync()
+
+        # Keep track of how long rain wakes take, logged on the next full wake. Kept
+        # in the rain buffer so it's written in place with the tip, rather than
+        # rewriting the whole state file. ticks_ms starts from 0 at power on, so this
+        # is the total time awake
+        RainBuffer().record(now(), ticks_ms())
+        recorded = True
+    except Exception as x:
+        # There's no logger on this path, and losing one tip is better than
+        # staying powered up
+        print_exception(x)
+    finally:
+        # Disable VSYS hold, cutting power to the pico (if on battery)
+        hold_vsys_en_pin.init(Pin.IN)
+
+    return recorded
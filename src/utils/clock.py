@@ -0,0 +1,45 @@
+from machine import RTC
+from time import gmtime, mktime, ticks_diff, ticks_ms
+
+# Unix style timestamp of the last RTC read, and the value of ticks_ms at that point
+_epoch = None
+_ticks = None
+
+
+def sync():
+    """
+    Read the pico's RTC into a unix style timestamp. Only needs to be done once per
+    wake, then again whenever the RTC is changed
+    """
+    global _epoch, _ticks
+    dt = RTC().datetime()
+    _ticks = ticks_ms()
+    # Pylance ignore following line as mktime's intellisense is messed up and thinks it
+    # shouldn't take an argument when actually it should
+    _epoch = mktime((dt[0], dt[1], dt[2], dt[4], dt[5], dt[6], 0, 0))  # type: ignore
+
+
+def now():
+    """
+    Get the current time, without reading the RTC again
+
+    Returns:
+      int: unix style timestamp of the current time
+    """
+    if _epoch is None:
+        sync()
+    return _epoch + ticks_diff(ticks_ms(), _ticks) // 1000
+
+
+def iso(epoch=None):
+    """
+    Format a unix style timestamp as a datetime string
+
+    Args:
+      epoch (int): Timestamp to format, defaults to the current time
+
+    Returns:
+      str: datetime string (format YYYY-mm-ddTHH:MM:SSZ)
+    """
+    dt = gmtime(now() if epoch is None else epoch)
+    return "{0:04d}-{1:02d}-{2:02d}T{3:02d}:{4:02d}:{5:02d}Z".format(*dt)
@@ -3,15 +3,66 @@
 # How often to wake the board and take readings in minutes
 READING_FREQUENCY = 15
 
-# How many readings to cache before uploading
+# How long to sample the anemometer for each reading in seconds. The sample runs
+# alongside startup and the other sensor reads, so 1 second keeps the board awake
+# no longer than the old blocking 1 second sample did, less whatever runs alongside
+# it. Gusts and lulls are averaged over 3 seconds, so they're only worked out for
+# samples of 3 seconds or more, otherwise both are the mean wind speed. Each extra
+# second keeps the board awake about a second longer on every reading wake
+WIND_SAMPLE_SECONDS = 1
+
+# How often to upload cached readings, in number of readings. Uploads happen every
+# UPLOAD_FREQUENCY * READING_FREQUENCY minutes
 UPLOAD_FREQUENCY = 4
 
+# Maximum number of readings to keep queued for upload while offline.
+# Once full, the oldest readings are discarded
+READING_QUEUE_CAPACITY = 2000
+
+# Maximum number of cached readings to send in a single upload request.
+# 1 sends each reading on its own, anything higher sends them as a JSON array
+UPLOAD_BATCH_SIZE = 4
+
+# Maximum size of a single upload request body in bytes. A reading bigger than
+# this on its own is still sent, just by itself
+UPLOAD_BATCH_MAX_BYTES = 32 * 1024
+
+# Gzip compress upload request bodies. Needs firmware with the deflate module,
+# otherwise uploads are sent uncompressed. The server must accept gzip encoded bodies
+UPLOAD_COMPRESSION = False
+
+# Send upload request bodies with chunked transfer encoding instead of a
+# Content-Length. Saves building each body twice, once to work out its length,
+# which matters most with compression on. The server must accept chunked bodies,
+# which many proxies and serverless platforms don't
+UPLOAD_CHUNKED = False
+
+# Limits on how long a single upload session can take in seconds and how much it can
+# send in bytes. Anything left in the queue is uploaded in the next session
+UPLOAD_SESSION_MAX_SECONDS = 60
+UPLOAD_SESSION_MAX_BYTES = 256 * 1024
+
+# Number of upload sessions that can fail in a row before uploads back off, and how
+# long to back off for in minutes. The backoff doubles with each further failure, up
+# to the maximum
+UPLOAD_BREAKER_THRESHOLD = 3
+UPLOAD_BACKOFF_BASE_MINUTES = 15
+UPLOAD_BACKOFF_MAX_MINUTES = 24 * 60
+
 # Wifi network credentials
 WIFI_SSID = ""
 WIFI_PASSWORD = ""
 WIFI_COUNTRY = "GB"
 WIFI_HOSTNAME = None
 
+# Reconnect straight to the access point used last time, skipping the scan
+WIFI_FAST_RECONNECT = True
+# How long to reuse the DHCP lease from the last connection for in hours
+WIFI_LEASE_REUSE_HOURS = 12
+# Static IP config as (ip, netmask, gateway, dns), or None to use DHCP
+# e.g. ("192.168.0.50", "255.255.255.0", "192.168.0.1", "192.168.0.1")
+WIFI_STATIC_IP = None
+
 # Name indentifier for this weathervane
 NICKNAME = ""
 
@@ -20,3 +71,44 @@ UPLOAD_DESTINATION = ""
 
 # How often RTC should be resynced in hours
 RTC_RESYNC_FREQUENCY = 168
+
+# Longest time to go without shipping logs in hours. Logs are attached to uploads,
+# so this only matters if it's shorter than the time between uploads
+LOG_SHIP_FREQUENCY = 24
+
+# Smoothed battery voltages below which to drop into the conserve and survival
+# energy tiers to make the battery last longer
+ENERGY_CONSERVE_VOLTAGE = 3.4
+ENERGY_SURVIVAL_VOLTAGE = 3.1
+
+# Settings for each energy tier, in order normal, conserve, survival:
+# How many times longer to leave between readings
+ENERGY_READING_SCALE = (1, 2, 4)
+# How many times more readings to wait for between uploads
+ENERGY_UPLOAD_SCALE = (1, 2, 6)
+# Minimum level of log entries to save to the log file, None to use LOG_FILE_LEVEL.
+# Never saves more than LOG_FILE_LEVEL would
+ENERGY_LOG_LEVELS = (None, "info", "warn")
+
+# Uploads, RTC resyncs and log shipping due within this many minutes of a wake are
+# done in that wake, rather than waking again just for them. Readings are always
+# taken at their set times
+SCHEDULE_COALESCE_MINUTES = 15
+
+# Minimum level of log entries to print to the console and save to the log file
+# One of "debug", "info", "warn", "error", "exception"
+LOG_CONSOLE_LEVEL = "debug"
+LOG_FILE_LEVEL = "debug"
+
+# Size in bytes log entries are buffered up to in memory before being written to
+# the log file. 0 writes every entry straight away
+LOG_BUFFER_SIZE = 2048
+
+# Run a garbage collection before each profiled phase of the wake, so the heap
+# usage recorded for a phase isn't skewed by garbage left over from the last one.
+# Useful when tracking down memory use, but slows every wake down a little
+MEMORY_PROFILE_STRICT = False
+
+# Minimum level of log entries to attach to cached readings
+# One of "debug", "info", "warn", "error", "exception"
+LOG_ATTACH_LEVEL = "debug"
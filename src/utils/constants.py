@@ -57,6 +57,97 @@ CYW43_STATUS_NAMES = {
     CYW43_LINK_BADAUTH: "Authentication failure",
 }
 
+# Scheduled tasks
+TASK_READING = 0
+TASK_UPLOAD = 1
+TASK_RESYNC = 2
+TASK_LOG_SHIP = 3
+
+# Scheduled tasks as strings for logging
+TASK_NAMES = {
+    TASK_READING: "reading",
+    TASK_UPLOAD: "upload",
+    TASK_RESYNC: "RTC resync",
+    TASK_LOG_SHIP: "log shipping",
+}
+
+# How early a scheduled task can run in seconds, to allow for the RTC alarm only
+# being accurate to the minute
+SCHEDULE_SLACK_SECONDS = 60
+
+# Energy tiers
+ENERGY_NORMAL = 0
+ENERGY_CONSERVE = 1
+ENERGY_SURVIVAL = 2
+
+# Energy tiers as strings for logging and uploading
+ENERGY_TIER_NAMES = {
+    ENERGY_NORMAL: "normal",
+    ENERGY_CONSERVE: "conserve",
+    ENERGY_SURVIVAL: "survival",
+}
+
+# Weight given to each new voltage reading in the smoothed voltage, between 0 and 1
+ENERGY_SMOOTHING = 0.2
+# How far past a tier threshold in volts the smoothed voltage has to recover before
+# going back up a tier
+ENERGY_HYSTERESIS = 0.1
+
+# Phases of a wake timed by the profiler
+PROFILE_PHASES = (
+    "boot",
+    "init",
+    "sensors",
+    "cache",
+    "connect",
+    "ntp",
+    "post",
+    "disconnect",
+    "wake",
+    "rotate",
+)
+# Phases timed around a block of code, which also have their heap usage recorded
+PROFILE_MEMORY_PHASES = (
+    "init",
+    "sensors",
+    "cache",
+    "connect",
+    "ntp",
+    "post",
+    "disconnect",
+    "rotate",
+)
+# Number of times a phase runs before its min, max and histogram start a new window
+PROFILE_WINDOW = 96
+# Number of histogram buckets, and how many times wider each is than the last
+PROFILE_BUCKET_COUNT = 8
+PROFILE_BUCKET_FACTOR = 4
+
+# Upload circuit breaker states
+BREAKER_CLOSED = 0
+BREAKER_OPEN = 1
+BREAKER_HALF_OPEN = 2
+
+# Upload circuit breaker states as strings for logging
+BREAKER_STATE_NAMES = {
+    BREAKER_CLOSED: "closed",
+    BREAKER_OPEN: "open",
+    BREAKER_HALF_OPEN: "half open",
+}
+
+# Shortest and longest time between wifi status checks while waiting in ms
+WIFI_POLL_MIN_MS = 10
+WIFI_POLL_MAX_MS = 250
+# How long to wait for a fast reconnect before falling back to a full connect in ms
+WIFI_FAST_TIMEOUT_MS = 3000
+
+# How long to wait on the upload server before giving up in seconds
+HTTP_TIMEOUT_SECONDS = 10
+# Size of the buffers request bodies are chunked and sent through in bytes
+HTTP_BUFFER_SIZE = 1024
+# Compression window size as a power of 2, larger compresses better but uses more RAM
+HTTP_COMPRESSION_WBITS = 10
+
 # NTP host URL
 NTP_HOST = "uk.pool.ntp.org"
 
@@ -66,8 +157,27 @@ NTP_HOST = "uk.pool.ntp.org"
 WIND_RADIUS_CM = 7.0
 # Scaling factor for wind speed in m/s
 WIND_FACTOR = 0.0218
+# Number of anemometer output changes that can be stored per sample. At 2 changes per
+# rotation this covers over 100 rotations per second for a 5 second sample
+WIND_EDGE_BUFFER_SIZE = 1024
+# Period wind gusts and lulls are averaged over in ms (WMO definition of a gust)
+WIND_GUST_WINDOW_MS = 3000
+# How far to slide the gust window along the sample each step in ms
+WIND_GUST_STEP_MS = 250
+# Voltage from the wind direction sensor for each 45 degree heading, starting at 0
+WIND_DIR_VOLTAGES = (0.9, 2.0, 3.0, 2.8, 2.5, 1.5, 0.3, 0.6)
+# Number of wind direction samples to average for each reading
+WIND_DIR_SAMPLES = 20
+# Time between wind direction samples in ms
+WIND_DIR_INTERVAL_MS = 10
+# Maximum time to spend sampling wind direction in ms
+WIND_DIR_DEADLINE_MS = 250
 # Amount of rain required for the bucket sensor to tip in mm
 RAIN_MM_PER_TICK = 0.2794
+# Number of rain tips kept in the rain buffer; each entry is 4 bytes, plus a 4 byte
+# header and 6 byte trailer, so this keeps the file within one filesystem block
+# (4096 bytes)
+RAIN_BUFFER_CAPACITY = 1021
 
 # Conversion for voltage reading
 ADC_VOLT_CONVERSION = 3.3 / 65535
@@ -0,0 +1,42 @@
+from ujson import dumps
+
+
+def write_object(write, obj, streamed={}):
+    """
+    Write out a JSON object, with some of its string values written in pieces rather
+    than built up in memory first
+
+    Args:
+      write (function): Called with each piece of the JSON text
+      obj (dict): Fields serialised as normal, written first
+      streamed (dict): Names of string fields to write after the others, mapped to
+        functions which write the field's value in pieces, as str or bytes, using
+        the function passed to them
+    """
+    text = dumps(obj)
+    if not streamed:
+        write(text)
+        return
+
+    # Reopen the object to add the streamed fields on the end
+    write(text[:-1])
+    separator = ", " if obj else ""
+    for name, write_value in streamed.items():
+        write(f'{separator}{dumps(name)}: "')
+        write_value(lambda piece: write_string_piece(write, piece))
+        write('"')
+        separator = ", "
+    write("}")
+
+
+def write_string_piece(write, piece):
+    """
+    Write a piece of a JSON string value, escaped but without the surrounding quotes
+
+    Args:
+      write (function): Called with the escaped piece
+      piece (str or bytes): Piece of the string, bytes must be whole UTF-8 characters
+    """
+    if isinstance(piece, bytes):
+        piece = piece.decode()
+    write(dumps(piece)[1:-1])